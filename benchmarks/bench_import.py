@@ -0,0 +1,69 @@
+# coding: utf-8
+"""Measure the cold import time of pywx and which heavy dependencies it loads.
+
+    python benchmarks/bench_import.py --runs 20 --check
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ('gevent', 'lxml', 'PIL', 'requests', 'sqlite3', 'qrcode')
+
+# Each run is a fresh interpreter, so nothing is imported yet.
+SCRIPT = '''
+import json, sys
+from timeit import default_timer
+started = default_timer()
+import %s
+elapsed = default_timer() - started
+print(json.dumps({'seconds': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+'''
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def measure(module, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT % (module, HEAVY_MODULES)])
+        results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+    return results
+
+
+def run(args):
+    results = measure(args.module, args.runs)
+    seconds = [result['seconds'] for result in results]
+    loaded = sorted(set(name for result in results for name in result['loaded']))
+    return {
+        'import_p50_ms': percentile(seconds, 50) * 1000,
+        'import_p99_ms': percentile(seconds, 99) * 1000,
+        'heavy_modules_loaded': len(loaded),
+    }, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='pywx.client')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--check', action='store_true', help='exit with 1 if a heavy module is loaded')
+    args = parser.parse_args()
+    result, loaded = run(args)
+    for key in sorted(result):
+        print('%-24s %12.2f' % (key, result[key]))
+    if loaded:
+        print('loaded: %s' % ', '.join(loaded))
+    if loaded and args.check:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# coding: utf-8
+"""Measure bytes per chatroom member for the contact model.
+
+    python benchmarks/bench_memory.py --contacts 5000 --chatrooms 200 --members 500
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import sys
+import threading
+
+from pywx.members import ChatroomMemberCache
+from pywx.models import Contact, ContactSet
+from pywx.testing import FakeWXServer
+
+
+class DictMember(object):
+    """The dict-backed, non-interned member the model used to be."""
+
+    def __init__(self, username, display_name=None, nickname=None):
+        self.username = username
+        self.display_name = display_name
+        self.nickname = nickname
+
+
+class Client(object):
+
+    event_class = staticmethod(threading.Event)
+    lock_class = staticmethod(threading.RLock)
+
+    def __init__(self):
+        self.contacts = ContactSet()
+        self.chatroom_members = ChatroomMemberCache(self, max_members=float('inf'))
+
+
+def deep_size(objects):
+    seen = set()
+    total = 0
+    for obj in objects:
+        for item in [obj, getattr(obj, '__dict__', None)] + [
+            getattr(obj, slot, None) for slot in ('username', 'display_name', 'nickname')
+        ]:
+            if item is None or id(item) in seen:
+                continue
+            seen.add(id(item))
+            total += sys.getsizeof(item)
+    return total
+
+
+def load_chatrooms(server):
+    # Decode the way the client does, so every occurrence is its own string.
+    return json.loads(json.dumps(server.chatrooms))
+
+
+def run(args):
+    server = FakeWXServer(
+        contacts=args.contacts, chatrooms=args.chatrooms, members=args.members, seed=args.seed
+    )
+
+    before = [
+        DictMember(member['UserName'], member['DisplayName'], member['NickName'])
+        for chatroom in load_chatrooms(server) for member in chatroom['MemberList']
+    ]
+
+    client = Client()
+    chatrooms = [Contact.from_wx_contact(client, chatroom) for chatroom in load_chatrooms(server)]
+    after = [member for chatroom in chatrooms for member in chatroom.members]
+
+    return {
+        'members': len(after),
+        'bytes_per_member_before': deep_size(before) / float(len(before)),
+        'bytes_per_member_after': deep_size(after) / float(len(after)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=5000)
+    parser.add_argument('--chatrooms', type=int, default=200)
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    result = run(parser.parse_args())
+    for key in sorted(result):
+        print('%-24s %12.2f' % (key, result[key]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# coding: utf-8
+"""Benchmark the login and sync/dispatch hot path against FakeWXServer.
+
+    python benchmarks/bench_sync.py --contacts 5000 --chatrooms 2000 --members 100
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import codecs
+import os
+import resource
+import sys
+from contextlib import contextmanager
+from timeit import default_timer
+
+from pywx.client import WXClient
+from pywx.testing import FakeWXServer, FakeTransport
+
+
+class BenchClient(WXClient):
+
+    def __init__(self, server, workers):
+        super(BenchClient, self).__init__(
+            transport=FakeTransport(server), workers=workers, qr_callback=lambda png, login_url: None
+        )
+        self.server = server
+        self.latencies = []
+        self.handlers.add_middleware(self._record_latency)
+
+    def _record_latency(self, message, call_next):
+        call_next(message)
+        self.latencies.append(default_timer() - self.server.created.pop(message['MsgId']))
+
+
+@contextmanager
+def quiet():
+    stdout = sys.stdout
+    with codecs.open(os.devnull, 'w', 'utf-8') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run(args):
+    server = FakeWXServer(
+        contacts=args.contacts, chatrooms=args.chatrooms, members=args.members,
+        batch_size=args.batch_size, seed=args.seed
+    )
+    client = BenchClient(server, workers=args.workers)
+
+    with quiet():
+        client._login()
+        started = default_timer()
+        client._initialize()
+        ready = default_timer() - started
+
+        dispatched = 0
+        started = default_timer()
+        while dispatched < args.messages:
+            client._sync_message()
+            dispatched += args.batch_size
+        client.message_workers.join()
+        elapsed = default_timer() - started
+
+    return {
+        'contacts': len(client.contacts),
+        'login_to_ready_ms': ready * 1000,
+        'messages': dispatched,
+        'messages_per_sec': dispatched / elapsed,
+        'latency_p50_ms': percentile(client.latencies, 50) * 1000,
+        'latency_p99_ms': percentile(client.latencies, 99) * 1000,
+        # ru_maxrss is reported in kilobytes on Linux.
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--chatrooms', type=int, default=200)
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    result = run(parser.parse_args())
+    for key in sorted(result):
+        print('%-20s %12.2f' % (key, result[key]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,3 @@
 # coding: utf-8
 
 __version__ = '0.0.1'
-
-from pywx.patchs import * # noqa
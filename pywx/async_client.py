@@ -0,0 +1,68 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import gevent
+import gevent.event
+import gevent.lock
+import gevent.monkey
+import gevent.queue
+
+from pywx.client import WXClient
+from pywx.transport import RequestsTransport
+
+
+class AsyncWXClient(WXClient):
+    """WXClient whose login, sync loop and sends run as gevent greenlets.
+
+    Many clients can share one hub as long as the transport is cooperative:
+    either call ``gevent.monkey.patch_all()`` before importing pywx, or pass a
+    transport that never blocks, such as :class:`pywx.testing.FakeTransport`.
+    A :class:`RequestsTransport` without the patches raises ``RuntimeError``.
+    """
+
+    queue_class = gevent.queue.JoinableQueue
+    event_class = gevent.event.Event
+    lock_class = gevent.lock.RLock
+    sleep = staticmethod(gevent.sleep)
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncWXClient, self).__init__(*args, **kwargs)
+        self._sync_greenlet = None
+        if isinstance(self.transport, RequestsTransport):
+            unpatched = [name for name in ('socket', 'threading') if not gevent.monkey.is_module_patched(name)]
+            if unpatched:
+                # Blocking sockets stall every greenlet, unpatched locks and events deadlock the hub.
+                raise RuntimeError(
+                    'AsyncWXClient needs gevent.monkey.patch_all() before importing pywx, not patched: %s'
+                    % ', '.join(unpatched)
+                )
+
+    def login(self):
+        return gevent.spawn(super(AsyncWXClient, self).login)
+
+    def logout(self):
+        self._kill_sync()
+        return gevent.spawn(super(AsyncWXClient, self).logout)
+
+    def stop(self):
+        super(AsyncWXClient, self).stop()
+        self._kill_sync()
+
+    @property
+    def syncing(self):
+        return self._sync_greenlet is not None and not self._sync_greenlet.dead
+
+    def join(self, timeout=None):
+        if self._sync_greenlet is not None:
+            self._sync_greenlet.join(timeout=timeout)
+
+    def _kill_sync(self):
+        if self._sync_greenlet is not None:
+            self._sync_greenlet.kill(block=False)
+            self._sync_greenlet = None
+
+    def _spawn(self, func, *args, **kwargs):
+        return gevent.spawn(func, *args, **kwargs)
+
+    def _start_sync(self):
+        self._sync_greenlet = self._spawn(self._sync)
@@ -0,0 +1,114 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import deque
+from timeit import default_timer
+
+from pywx import config
+from pywx.exceptions import TransportError
+from pywx.utils import backoff_delay
+
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class ChunkSizer(object):
+    """Picks webwxbatchgetcontact chunk sizes.
+
+    The size is halved after a failed, slow (over ``target_latency``) or
+    large (over ``target_entries`` contacts and members) response and grows
+    by ``step`` after a fast one.
+    """
+
+    def __init__(self, initial=config.BATCH_CHUNK_SIZE, minimum=config.BATCH_CHUNK_MIN,
+                 maximum=config.BATCH_CHUNK_SIZE, target_latency=config.BATCH_TARGET_LATENCY,
+                 target_entries=config.BATCH_TARGET_ENTRIES, step=config.BATCH_CHUNK_STEP):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.target_entries = target_entries
+        self.step = step
+        self._lock = threading.Lock()
+
+    def update(self, latency, entries, ok=True):
+        with self._lock:
+            if not ok or latency > self.target_latency or entries > self.target_entries:
+                self.size = max(self.minimum, self.size // 2)
+            elif latency < self.target_latency / 2.0:
+                self.size = min(self.maximum, self.size + self.step)
+
+
+class BatchContactFetcher(object):
+    """Fetches contacts by username, up to ``concurrency`` chunks at a time.
+
+    Chunks are cut from the pending usernames as workers free up, sized by
+    the client's :class:`ChunkSizer`, and each is retried on its own.
+    ``fetch`` yields contacts as their chunk completes; usernames whose
+    chunk kept failing are logged and left in ``failed``.
+    """
+
+    def __init__(self, client, concurrency=config.BATCH_FETCH_CONCURRENCY, retries=config.BATCH_FETCH_RETRIES,
+                 sizer=None):
+        self.client = client
+        self.concurrency = concurrency
+        self.retries = retries
+        self.sizer = sizer or ChunkSizer()
+        self.failed = []
+
+    def fetch(self, usernames, encry_chatroom_id=None):
+        pending = deque(usernames)
+        if not pending:
+            return
+        if len(pending) <= self.sizer.size:
+            for contact in self._fetch_chunk(list(pending), encry_chatroom_id):
+                yield contact
+            return
+
+        lock = threading.Lock()
+        results = self.client.queue_class()
+
+        def _work():
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        chunk = [pending.popleft() for _ in range(min(self.sizer.size, len(pending)))]
+                    results.put(self._fetch_chunk(chunk, encry_chatroom_id))
+            finally:
+                results.put(_DONE)
+
+        workers = min(self.concurrency, (len(pending) + self.sizer.size - 1) // self.sizer.size)
+        for _ in range(workers):
+            self.client._spawn(_work)
+        while workers:
+            contacts = results.get()
+            if contacts is _DONE:
+                workers -= 1
+                continue
+            for contact in contacts:
+                yield contact
+
+    def _fetch_chunk(self, usernames, encry_chatroom_id):
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.client.sleep(backoff_delay(attempt, config.BATCH_BACKOFF_BASE))
+            started = default_timer()
+            try:
+                contacts = self.client._batch_get_contacts_chunk(usernames, encry_chatroom_id)
+            except (TransportError, ValueError, KeyError) as e:
+                self.sizer.update(default_timer() - started, 0, ok=False)
+                error = e
+                continue
+            entries = len(contacts) + sum(len(contact.get('MemberList') or ()) for contact in contacts)
+            self.sizer.update(default_timer() - started, entries)
+            return contacts
+        logger.warning('batch get of %d contacts failed: %r', len(usernames), error)
+        self.failed.extend(usernames)
+        return []
@@ -0,0 +1,112 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from pywx import config
+from pywx.models import Message
+from pywx.outbox import TokenBucket
+
+
+BroadcastResult = namedtuple('BroadcastResult', ('username', 'status', 'error'))
+
+SENT = 'sent'
+FAILED = 'failed'
+
+
+class Broadcast(object):
+    """Sends one text to many recipients through the client's outbox.
+
+    At most ``concurrency`` sends are queued at a time and they go out at
+    the client's ``send_rate``, or at ``rate`` per second when that is
+    lower.  Each outcome is appended to ``checkpoint``; running the same
+    broadcast again skips recipients already recorded as sent.
+    """
+
+    def __init__(self, client, content, recipients, checkpoint=None,
+                 concurrency=config.BROADCAST_CONCURRENCY, rate=None):
+        self.client = client
+        self.content = content
+        self.recipients = recipients
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.bucket = None
+        if rate and rate < client.outbox.bucket.rate:
+            self.bucket = TokenBucket(rate, burst=1, sleep=client.sleep)
+        self.results = OrderedDict()
+        self._lock = threading.Lock()
+        self._checkpoint_fd = None
+
+    def run(self):
+        done = self._load_checkpoint()
+        self.results.update((username, result) for username, result in done.items() if result.status == SENT)
+        slots = self.client.queue_class(self.concurrency)
+        seen = set()
+        if self.checkpoint is not None:
+            self._checkpoint_fd = io.open(self.checkpoint, 'a', encoding='utf-8')
+        try:
+            for recipient in self.recipients:
+                username = getattr(recipient, 'username', recipient)
+                if username in self.results or username in seen:
+                    continue
+                seen.add(username)
+                slots.put(None)
+                if self.bucket is not None:
+                    self.bucket.acquire()
+                message = Message(
+                    content=self.content, type=config.MessageType.TEXT.value,
+                    from_username=self.client.user.username, to_username=username
+                )
+                ticket = self.client.outbox.submit(message)
+                ticket.add_done_callback(lambda ticket: self._record(ticket, slots))
+            # Tickets are set before their callbacks run, wait for every _record instead.
+            slots.join()
+        finally:
+            with self._lock:
+                if self._checkpoint_fd is not None:
+                    self._checkpoint_fd.flush()
+                    os.fsync(self._checkpoint_fd.fileno())
+                    self._checkpoint_fd.close()
+                    self._checkpoint_fd = None
+        return self.results
+
+    def _record(self, ticket, slots):
+        username = ticket.message.to_username
+        if ticket.error is None:
+            result = BroadcastResult(username, SENT, None)
+        else:
+            result = BroadcastResult(username, FAILED, '%s' % ticket.error)
+        try:
+            with self._lock:
+                self.results[username] = result
+                if self._checkpoint_fd is not None:
+                    self._checkpoint_fd.write('%s\n' % json.dumps(result._asdict(), ensure_ascii=False))
+                    self._checkpoint_fd.flush()
+        finally:
+            slots.get()
+            slots.task_done()
+
+    def _load_checkpoint(self):
+        done = OrderedDict()
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return done
+        end = 0
+        with io.open(self.checkpoint, 'rb') as fd:
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                try:
+                    result = BroadcastResult(**json.loads(line.decode('utf-8')))
+                except (ValueError, TypeError):
+                    continue
+                done[result.username] = result
+        if os.path.getsize(self.checkpoint) > end:
+            # Drop the line torn by a crash mid-write, so the next record starts on its own line.
+            with io.open(self.checkpoint, 'r+b') as fd:
+                fd.truncate(end)
+        return done
@@ -4,27 +4,52 @@ from __future__ import unicode_literals
 import logging
 import os.path
 import threading
-from itertools import chain
+import time
+from timeit import default_timer
+from xml.sax.saxutils import escape
 
-import gevent
-import gevent.monkey
-import requests
-from lxml import etree
-from six import StringIO
-from PIL import Image
+from six.moves import queue
 
 from pywx import config
+from pywx import qr
+from pywx.batch import BatchContactFetcher, ChunkSizer
+from pywx.broadcast import Broadcast
+from pywx.dedup import MessageDeduplicator
+from pywx.dispatch import HandlerRegistry
+from pywx.events import ContactAdded, ContactRemoved, ContactUpdated, MembersChanged
+from pywx.exceptions import TransportError, TransportTimeout
+from pywx.jsonstream import iter_json_object
+from pywx.metrics import Metrics
+from pywx.media import MediaUploader
+from pywx.members import ChatroomMemberCache
+from pywx.outbox import Outbox
+from pywx.sync import SyncScheduler
+from pywx.tracing import SamplingProfiler, real_get_ident, traced
+from pywx.workers import PartitionedWorkerPool
 from pywx.models import (
-    User, Contact, ChatroomContact, ContactSet, Message,
+    CONTACT_FIELDS, MEMBER_FIELDS, User, Contact, ChatroomContact, ChatroomMember, ContactSet, Message,
 )
 from pywx.utils import (
-    chunks, gen_device_id, timestamp_now, bitwise_not,
-    gen_client_msg_id, emoji_formatter
+    gen_device_id, timestamp_now, bitwise_not,
+    gen_client_msg_id, emoji_formatter, endpoint_name
 )
 
 
 logger = logging.getLogger(__name__)
 
+MEDIA_URLS = {
+    config.MessageType.IMAGE: config.WX_GET_MSG_IMG_URL,
+    config.MessageType.EMOTICON: config.WX_GET_MSG_IMG_URL,
+    config.MessageType.VOICE: config.WX_GET_VOICE_URL,
+    config.MessageType.VIDEO: config.WX_GET_VIDEO_URL,
+}
+
+APPMSG_FILE_TEMPLATE = (
+    "<appmsg appid='wxeb7ec651dd0aefa9' sdkver=''><title>{title}</title><des></des><action></action>"
+    "<type>6</type><content></content><url></url><lowurl></lowurl><appattach><totallen>{size}</totallen>"
+    "<attachid>{media_id}</attachid><fileext>{ext}</fileext></appattach><extinfo></extinfo></appmsg>"
+)
+
 
 class WXClient(object):
 
@@ -33,10 +58,23 @@ class WXClient(object):
         for item in config.MessageType
     }
 
-    def __init__(self):
+    queue_class = queue.Queue
+    event_class = staticmethod(threading.Event)
+    lock_class = staticmethod(threading.RLock)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, transport=None, contacts_snapshot=None, session_store=None,
+                 member_budget=config.CHATROOM_MEMBER_BUDGET, workers=config.WORKER_POOL_SIZE, message_log=None,
+                 message_index=None, metrics=None, tracer=None, media_cache=None, qr_callback=None,
+                 send_rate=config.SEND_RATE, send_burst=config.SEND_BURST):
         self._online = False
-        self.session = requests.Session()
-        self.session.headers.update(config.DEFAULT_HEADERS)
+        if transport is None:
+            # Imported here so clients on a custom transport never load requests.
+            from pywx.transport import RequestsTransport
+            transport = RequestsTransport()
+        self.transport = transport
+        self.contacts_snapshot = contacts_snapshot
+        self.session_store = session_store
 
         self.device_id = gen_device_id()
         self.uin = None
@@ -47,10 +85,38 @@ class WXClient(object):
         self.sync_key = None
 
         self.contacts = ContactSet()
+        self.contact_chunk_sizer = ChunkSizer()
+        self.chatroom_members = ChatroomMemberCache(self, max_members=member_budget)
+        self.sync_scheduler = SyncScheduler(self, sleep=self.sleep)
+
+        self.metrics = metrics or Metrics()
+        self.tracer = None
+        self._tracing_installed = False
+        self._sync_ident = None
+        self.message_dedup = MessageDeduplicator()
+        self.message_log = message_log
+        self.handlers = HandlerRegistry()
+        for message_type, name in self.MESSAGE_HANDLERS.items():
+            handler = getattr(self, '_process_%s_message' % name, self._process_unsupport_message)
+            self.handlers.set_default(message_type, handler)
+        self.handlers.add_middleware(self._observe_message)
+        self.message_index = message_index
+        if message_index is not None:
+            self.handlers.add_middleware(self._index_text_message, config.MessageType.TEXT.value)
+        self.message_workers = PartitionedWorkerPool(
+            self.handlers.dispatch, size=workers, maxsize=config.WORKER_QUEUE_SIZE,
+            key=lambda message: message['FromUserName'], spawn=self._spawn, queue_class=self.queue_class
+        )
+        self.outbox = Outbox(self, rate=send_rate, burst=send_burst)
+        self.media_uploader = MediaUploader(self)
+        self.media_cache = media_cache
+        self.qr_callback = qr_callback or qr.show_image
+        if tracer is not None:
+            self.set_tracer(tracer)
 
     @property
     def lang(self):
-        return self.session.cookies.get('mm_lang', 'zh_CN')
+        return self.transport.cookies.get('mm_lang', 'zh_CN')
 
     @property
     def sync_key_str(self):
@@ -66,8 +132,13 @@ class WXClient(object):
         return self._online
 
     def login(self):
-        self._login()
-        self._initialize()
+        # Workers stopped by an earlier stop() only come back with a new login.
+        self.message_workers.start()
+        self.outbox.start()
+        if not self._resume():
+            self._login()
+            self._initialize()
+            self._save_session()
         self._start_sync()
 
     def logout(self):
@@ -80,15 +151,107 @@ class WXClient(object):
             'sid': self.sid,
             'uin': self.uin
         }
-        self.session.post(config.WX_LOGOUT_URL, params=params, data=data)
+        self._request('POST', config.WX_LOGOUT_URL, params=params, data=data)
+        self.stop()
+        if self.session_store is not None:
+            self.session_store.clear()
+
+    def stop(self):
         self._online = False
+        self.message_workers.stop()
+        self.outbox.stop()
+        if self.message_log is not None:
+            self.message_log.flush()
+        if self.message_index is not None:
+            self.message_index.commit()
+
+    def _on_logout(self, retcode):
+        logger.info('session ended by server, retcode %s', retcode)
+        self.stop()
+        if self.session_store is not None:
+            self.session_store.clear()
+
+    def _resume(self):
+        if self.session_store is None:
+            return False
+        state = self.session_store.load()
+        if not state:
+            return False
+        self._load_session_state(state)
+        try:
+            retcode, _ = self._sync_check(timeout=config.SESSION_CHECK_TIMEOUT)
+        except TransportTimeout:
+            # Only a live session is held open by the long-poll.
+            retcode = 0
+        if retcode != 0:
+            self.session_store.clear()
+            return False
+        self._online = True
+        self._restore_contacts()
+        self._spawn(self._refresh_contacts)
+        return True
+
+    def _dump_session_state(self):
+        return {
+            'cookies': self.transport.dump_cookies(),
+            'device_id': self.device_id,
+            'uin': self.uin,
+            'sid': self.sid,
+            'skey': self.skey,
+            'pass_ticket': self.pass_ticket,
+            'sync_key': self.sync_key,
+            'user': self.user.raw,
+            'recent_msg_ids': self.message_dedup.dump(),
+        }
+
+    def _load_session_state(self, state):
+        self.transport.load_cookies(state['cookies'])
+        self.device_id = state['device_id']
+        self.uin = state['uin']
+        self.sid = state['sid']
+        self.skey = state['skey']
+        self.pass_ticket = state['pass_ticket']
+        self.sync_key = state['sync_key']
+        user = state['user']
+        self.user = User(
+            uin=user['Uin'], username=user['UserName'], nickname=user['NickName'], raw=user
+        )
+        self.message_dedup.load(state.get('recent_msg_ids', ()))
+
+    def _save_session(self):
+        if self.session_store is None or not self._online:
+            return
+        self.session_store.save(self._dump_session_state())
+
+    def set_tracer(self, tracer):
+        # _trace_message passes messages through while the tracer is None, install it once.
+        if tracer is not None and not self._tracing_installed:
+            self.handlers.add_middleware(self._trace_message)
+            self._tracing_installed = True
+        self.tracer = tracer
+
+    def start_profiler(self, interval=config.PROFILER_INTERVAL):
+        """Starts sampling the sync loop's thread, ``stop()`` then ``dump(path)`` the profiler."""
+        return SamplingProfiler(lambda: self._sync_ident, interval).start()
+
+    def _request(self, method, url, **kwargs):
+        started = default_timer()
+        try:
+            res = self.transport.request(method, url, **kwargs)
+        except TransportError:
+            self.metrics.observe_request(endpoint_name(url), default_timer() - started, error=True)
+            raise
+        # Streamed responses are timed up to their headers.
+        self.metrics.observe_request(
+            endpoint_name(url), default_timer() - started, error=getattr(res, 'status_code', 200) >= 400
+        )
+        return res
 
     def _login(self):
         uuid = self._get_login_uuid()
         if not uuid:
             return
-        qrimg = self._get_qrimg(uuid)
-        qrimg.show()
+        self.qr_callback(self._get_qrcode(uuid), config.WX_QR_LOGIN_URL + uuid)
         while not self._online:
             success, login_info_url = self._login_check(uuid)
             if not success:
@@ -97,23 +260,24 @@ class WXClient(object):
             self._process_login_info(login_info)
             self._online = True
 
+    @traced('login.get_uuid')
     def _get_login_uuid(self):
         params = {
             'appid': config.APP_ID,
             'fun': 'new',
         }
-        res = self.session.get(config.WX_JSLOING_URL, params=params, timeout=config.DEFAULT_TIMEOUT)
+        res = self._request('GET', config.WX_JSLOING_URL, params=params)
         match = config.RE_JSLOGING_PATTERN.search(res.content)
         if not match:
             return
         return match.group('uuid')
 
-    def _get_qrimg(self, uuid):
+    def _get_qrcode(self, uuid):
         qrimg_url = os.path.join(config.WX_QRIMG_BASE_URL, uuid)
-        res = self.session.get(qrimg_url, timeout=config.DEFAULT_TIMEOUT)
-        qrimg = Image.open(StringIO(res.content))
-        return qrimg
+        res = self._request('GET', qrimg_url)
+        return res.content
 
+    @traced('login.check')
     def _login_check(self, uuid):
         local_time = timestamp_now()
         params = {
@@ -123,14 +287,16 @@ class WXClient(object):
             'r': bitwise_not(local_time),
             '_': local_time
         }
-        res = self.session.get(config.WX_LOING_CHECK_URL, params=params)
+        res = self._request('GET', config.WX_LOING_CHECK_URL, params=params)
         match = config.RE_LOGING_CHECK_PATTERN.search(res.content)
         if not match:
             return False, None
         return True, match.group('redirect_url')
 
     def _get_login_info(self, login_info_url):
-        res = self.session.get(login_info_url, allow_redirects=False, timeout=config.DEFAULT_TIMEOUT)
+        from lxml import etree
+
+        res = self._request('GET', login_info_url, allow_redirects=False)
         document = etree.fromstring(res.content)
         return {elem.tag: elem.text for elem in document}
 
@@ -151,17 +317,16 @@ class WXClient(object):
             'FromUserName': self.user.username,
             'ToUserName': to_username or self.user.username
         })
-        self.session.post(
-            config.WX_STATUS_NOTIFY_URL, params=params, json=data, timeout=config.DEFAULT_TIMEOUT
-        )
+        self._request('POST', config.WX_STATUS_NOTIFY_URL, params=params, json=data)
 
+    @traced('login.initialize')
     def _initialize(self):
         params = {
             'r': bitwise_not(timestamp_now()),
             'pass_ticket': self.pass_ticket,
         }
         data = self._gen_base_request()
-        res = self.session.post(config.WX_INIT_URL, params=params, json=data)
+        res = self._request('POST', config.WX_INIT_URL, params=params, json=data)
         res.encoding = 'UTF-8'
         init_data = res.json()
         user = init_data['User']
@@ -169,15 +334,42 @@ class WXClient(object):
             uin=user['Uin'], username=user['UserName'], nickname=user['NickName'], raw=user
         )
         self.sync_key = init_data['SyncKey']
+        restored = self._restore_contacts()
+        init_usernames = []
         for contact in init_data['ContactList']:
             contact = Contact.from_wx_contact(self, contact)
-            self.contacts.add_or_update(contact)
+            self._add_contact(contact)
+            init_usernames.append(contact.username)
 
         self._notify_mobile(config.StatusNotifyCode.INITED.value)
-        self._init_contacts()
-        chatroom_usernames = (chatroom.username for chatroom in self.contacts.chatroooms)
-        self._batch_get_contacts(chatroom_usernames)
+        if restored:
+            self._spawn(self._refresh_contacts, init_usernames)
+        else:
+            self._refresh_contacts(init_usernames)
+
+    def _restore_contacts(self):
+        if self.contacts_snapshot is None:
+            return False
+        contacts = self.contacts_snapshot.load(self, self.uin)
+        for contact in contacts:
+            self._add_contact(contact)
+        return bool(contacts)
+
+    def _refresh_contacts(self, seen_usernames=()):
+        stale_usernames = set(contact.username for contact in self.contacts)
+        stale_usernames.difference_update(seen_usernames)
+        stale_usernames.difference_update(self._init_contacts())
+        for username in stale_usernames:
+            contact = self.contacts[username]
+            # webwxgetcontact leaves out chatrooms not saved to contacts, those
+            # known from webwxinit or statusnotify go only through DelContactList.
+            if contact is None or isinstance(contact, ChatroomContact):
+                continue
+            self.contacts.remove(contact)
+        if self.contacts_snapshot is not None:
+            self.contacts_snapshot.save(self.uin, self.contacts)
 
+    @traced('login.init_contacts')
     def _init_contacts(self):
         params = {
             'pass_ticket': self.pass_ticket,
@@ -186,57 +378,80 @@ class WXClient(object):
             'skey': self.skey,
             'lang': self.lang,
         }
-        res = self.session.get(config.WX_GET_CONTACT_URL, params=params)
-        res.encoding = 'UTF-8'
-        res_data = res.json()
-        for member in res_data['MemberList']:
+        res = self._request('GET', config.WX_GET_CONTACT_URL, params=params, stream=True)
+        usernames = []
+        for key, member in self._iter_json(res, stream_keys=('MemberList',)):
+            if key != 'MemberList':
+                continue
             contact = Contact.from_wx_contact(self, member)
-            self.contacts.add_or_update(contact)
-
-    def _batch_get_contacts(self, usernames, encry_chatroom_id=None):
-
-        def _get_contacts(usernames):
-            params = {
-                'type': 'ex',
-                'r': timestamp_now(),
-                'pass_ticket': self.pass_ticket
-            }
-            data = self._gen_base_request()
-            data.update({
-                'Count': len(usernames),
-                'List': [
-                    {
-                        'EncryChatRoomId': encry_chatroom_id or '',
-                        'UserName': username
-                    }
-                    for username in usernames
+            self._add_contact(contact)
+            usernames.append(contact.username)
+        return usernames
+
+    def _add_contact(self, contact):
+        old_contact = self.contacts[contact.username]
+        if isinstance(contact, ChatroomContact) and not contact.members_loaded \
+                and isinstance(old_contact, ChatroomContact) and old_contact.members_loaded:
+            contact.load_members(old_contact.members)
+        self.contacts.add_or_update(contact)
+        if isinstance(contact, ChatroomContact):
+            if contact.members_loaded:
+                self.chatroom_members.add(contact)
+            else:
+                self.chatroom_members.discard(contact)
+
+    def _fetch_chatroom_members(self, chatroom):
+        """Returns the chatroom's members, or None when they could not be fetched."""
+        for contact in self._batch_get_contacts([chatroom.username], chatroom.encry_chatroom_id):
+            if contact['UserName'] == chatroom.username:
+                return [
+                    ChatroomMember.from_wx_member(member, intern=self.contacts.intern)
+                    for member in contact['MemberList']
                 ]
-            })
-            res = self.session.post(config.WX_BATCH_GET_CONTACTS_URL, params=params, json=data)
-            res.encoding = 'UTF-8'
-            res_data = res.json()
-            return res_data['ContactList']
+        return None
 
-        jobs = [gevent.spawn(_get_contacts, chunk) for chunk in chunks(usernames, 50)]
-        gevent.joinall(jobs)
-        contacts_iter = chain(*(job.value for job in jobs))
+    def _batch_get_contacts(self, usernames, encry_chatroom_id=None):
+        fetcher = BatchContactFetcher(self, sizer=self.contact_chunk_sizer)
+        return fetcher.fetch(usernames, encry_chatroom_id)
 
-        return contacts_iter
+    def _batch_get_contacts_chunk(self, usernames, encry_chatroom_id=None):
+        params = {
+            'type': 'ex',
+            'r': timestamp_now(),
+            'pass_ticket': self.pass_ticket
+        }
+        data = self._gen_base_request()
+        data.update({
+            'Count': len(usernames),
+            'List': [
+                {
+                    'EncryChatRoomId': encry_chatroom_id or '',
+                    'UserName': username
+                }
+                for username in usernames
+            ]
+        })
+        res = self._request('POST', config.WX_BATCH_GET_CONTACTS_URL, params=params, json=data, stream=True)
+        return [
+            contact for key, contact in self._iter_json(res, stream_keys=('ContactList',))
+            if key == 'ContactList'
+        ]
+
+    def _spawn(self, func, *args, **kwargs):
+        thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+        thread.setDaemon(True)
+        thread.start()
+        return thread
 
     def _start_sync(self):
+        self._spawn(self._sync)
 
-        def _sync():
-            while self.online:
-                selector = self._sync_check()
-                if selector == 0:
-                    continue
-                self._sync_message()
-
-        sync_thread = threading.Thread(target=_sync)
-        sync_thread.setDaemon(True)
-        sync_thread.start()
+    def _sync(self):
+        self._sync_ident = real_get_ident()
+        self.sync_scheduler.run()
 
-    def _sync_check(self):
+    @traced('sync.check')
+    def _sync_check(self, timeout=None):
         params = {
             'r': timestamp_now(),
             'skey': self.skey,
@@ -246,13 +461,13 @@ class WXClient(object):
             'synckey': self.sync_key_str,
             '_': timestamp_now(),
         }
-        res = self.session.get(config.WX_SYNC_CHECK_URL, params=params)
+        res = self._request('GET', config.WX_SYNC_CHECK_URL, params=params, timeout=timeout)
         match = config.RE_SYNC_CHECK_PATTERN.search(res.content)
         if not match:
-            return
-        selector = int(match.group('selector'))
-        return selector
+            return None, None
+        return int(match.group('retcode')), int(match.group('selector'))
 
+    @traced('sync.message')
     def _sync_message(self):
         params = {
             'sid': self.sid,
@@ -264,24 +479,127 @@ class WXClient(object):
             'SyncKey': self.sync_key,
             'rr': bitwise_not(timestamp_now())
         })
-        res = self.session.post(config.WX_SYNC_URL, params=params, json=data)
-        res.encoding = 'UTF-8'
-        res_data = res.json()
-
+        res = self._request('POST', config.WX_SYNC_URL, params=params, json=data, stream=True)
+        res_data = {}
+
+        def _iter_messages():
+            for key, value in self._iter_json(res, stream_keys=('AddMsgList',)):
+                if key == 'AddMsgList':
+                    yield value
+                else:
+                    res_data[key] = value
+
+        # Messages are dispatched as they are decoded, SyncKey follows them in the response.
+        self._process_messages(_iter_messages())
+        self._process_contact_changes(res_data)
         self.sync_key = res_data['SyncKey']
-        message_list = res_data['AddMsgList']
-        self._process_messages(message_list)
+        self._save_session()
+
+    def _process_contact_changes(self, res_data):
+        for contact in res_data.get('ModContactList', ()):
+            self._apply_contact_change(contact)
+        for contact in res_data.get('DelContactList', ()):
+            self._apply_contact_removal(contact['UserName'])
+        for chatroom in res_data.get('ModChatRoomMemberList', ()):
+            self._apply_member_changes(chatroom)
+
+    def _apply_contact_change(self, wx_contact):
+        new_contact = Contact.from_wx_contact(self, wx_contact)
+        contact = self.contacts[new_contact.username]
+        if contact is None or type(contact) is not type(new_contact):
+            self._add_contact(new_contact)
+            self.handlers.dispatch_change(ContactAdded(new_contact))
+            return
 
-    def _process_messages(self, messages):
-        for message in messages:
-            message_type = self.MESSAGE_HANDLERS.get(message['MsgType'])
-            if not message_type:
+        changes = {}
+        for field in CONTACT_FIELDS:
+            old_value, new_value = getattr(contact, field), getattr(new_contact, field)
+            if old_value != new_value:
+                changes[field] = (old_value, new_value)
+                setattr(contact, field, new_value)
+        if changes:
+            self.contacts.add_or_update(contact)
+            self.handlers.dispatch_change(ContactUpdated(contact, changes))
+        if isinstance(contact, ChatroomContact) and wx_contact.get('MemberList'):
+            self._apply_member_changes(wx_contact)
+
+    def _apply_contact_removal(self, username):
+        contact = self.contacts[username]
+        if contact is None:
+            return
+        self.contacts.remove(contact)
+        if isinstance(contact, ChatroomContact):
+            self.chatroom_members.discard(contact)
+        self.handlers.dispatch_change(ContactRemoved(contact))
+
+    def _apply_member_changes(self, wx_chatroom):
+        chatroom = self.contacts[wx_chatroom['UserName']]
+        # Unloaded chatrooms pick up the current members when they are next accessed.
+        if not isinstance(chatroom, ChatroomContact) or not chatroom.members_loaded:
+            return
+        members = {}
+        for member in wx_chatroom['MemberList']:
+            member = ChatroomMember.from_wx_member(member, intern=self.contacts.intern)
+            members[member.username] = member
+
+        added, removed, updated = [], [], []
+        for member in chatroom.members:
+            if member.username not in members:
+                chatroom.remove_member(member)
+                removed.append(member)
+        for username, new_member in members.items():
+            member = chatroom.get_member(username)
+            if member is None:
+                chatroom.add_member(new_member)
+                added.append(new_member)
                 continue
-            message_handler = getattr(self, '_process_%s_message' % message_type, None)
-            if not message_handler:
-                self._process_unsupport_message(message)
-            else:
-                message_handler(message)
+            changed = False
+            for field in MEMBER_FIELDS:
+                new_value = getattr(new_member, field)
+                if getattr(member, field) != new_value:
+                    setattr(member, field, new_value)
+                    changed = True
+            if changed:
+                updated.append(member)
+        if added or removed or updated:
+            self.chatroom_members.add(chatroom)
+            self.handlers.dispatch_change(MembersChanged(chatroom, added, removed, updated))
+
+    def _iter_json(self, res, stream_keys=()):
+        try:
+            for item in iter_json_object(res.iter_content(config.JSON_CHUNK_SIZE), stream_keys=stream_keys):
+                yield item
+        finally:
+            res.close()
+
+    def _process_messages(self, messages):
+        submit = self.message_workers.submit
+        log = self.message_log
+        for message in self.message_dedup.filter(messages):
+            if log is not None:
+                log.append(message)
+            submit(message)
+
+    def _observe_message(self, message, call_next):
+        started = default_timer()
+        self.metrics.observe_sync_lag(time.time() - message['CreateTime'])
+        try:
+            call_next(message)
+        finally:
+            self.metrics.observe_message(message['MsgType'], default_timer() - started)
+
+    def _trace_message(self, message, call_next):
+        tracer = self.tracer
+        if tracer is None:
+            call_next(message)
+            return
+        token = tracer.start_span('dispatch', {'type': message['MsgType'], 'from': message['FromUserName']})
+        try:
+            call_next(message)
+        except BaseException as e:
+            tracer.end_span(token, e)
+            raise
+        tracer.end_span(token)
 
     def _process_unsupport_message(self, message):
         from_username = message['FromUserName']
@@ -289,6 +607,39 @@ class WXClient(object):
 
         print 'From: %s, 目前不支持该消息的显示，请在手机查看' % from_contact.nickname
 
+    def _process_media_message(self, message):
+        if self.media_cache is None:
+            return self._process_unsupport_message(message)
+        from_contact = self.contacts[message['FromUserName']]
+        path = self.download_media(message)
+        print 'From: %s, Media: %s' % (from_contact.nickname, path)
+
+    _process_image_message = _process_media_message
+    _process_voice_message = _process_media_message
+    _process_video_message = _process_media_message
+    _process_emoticon_message = _process_media_message
+
+    def download_media(self, message):
+        """Returns the local path of an image, voice, video or emoticon message's media."""
+        url = MEDIA_URLS[message['MsgType']]
+        if url == config.WX_GET_MSG_IMG_URL:
+            params = {'MsgID': message['MsgId'], 'skey': self.skey}
+        else:
+            params = {'msgid': message['MsgId'], 'skey': self.skey}
+        headers = {'Range': 'bytes=0-'} if url == config.WX_GET_VIDEO_URL else None
+
+        def download():
+            res = self._request('GET', url, params=params, headers=headers, stream=True)
+            try:
+                if getattr(res, 'status_code', 200) >= 400:
+                    raise TransportError('%s returned %s' % (endpoint_name(url), res.status_code))
+                for chunk in res.iter_content(config.MEDIA_DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+            finally:
+                res.close()
+
+        return self.media_cache.fetch(message['MsgId'], download, self.event_class)
+
     def _process_statusnotify_message(self, message):
         if config.StatusNotifyCode.SYNC_CONV != message['StatusNotifyCode']:
             return
@@ -297,7 +648,8 @@ class WXClient(object):
         contacts = self._batch_get_contacts(chatroom_usernames)
         for contact in contacts:
             contact = Contact.from_wx_contact(self, contact)
-            self.contacts.add_or_update(contact)
+            self._add_contact(contact)
+            self.handlers.dispatch_change(ContactAdded(contact))
 
     def _process_text_message(self, message):
         content = emoji_formatter(message['Content'])
@@ -308,24 +660,66 @@ class WXClient(object):
 
         if isinstance(from_contact, ChatroomContact):
             member_username, content = content.split(':<br/>')
-            member_contact = self.contacts[member_username]
+            # Members who are not friends are only known to their chatroom.
+            member = self.contacts[member_username] or from_contact.get_member(member_username)
             print 'From: %s[%s], To: %s, Msg: %s' % (
-                from_contact.nickname, member_contact.nickname, to_contact.nickname, content
+                from_contact.nickname, member.nickname if member else member_username, to_contact.nickname, content
             )
         else:
             print 'From: %s, To: %s, Msg: %s' % (from_contact.nickname, to_contact.nickname, content)
 
+    def _index_text_message(self, message, call_next):
+        content = emoji_formatter(message['Content'])
+        from_username = message['FromUserName']
+        if from_username.startswith('@@'):
+            conversation = from_username
+            sender, content = content.split(':<br/>', 1)
+        elif from_username == self.user.username:
+            conversation, sender = message['ToUserName'], from_username
+        else:
+            conversation = sender = from_username
+        self.message_index.add(message['MsgId'], conversation, sender, message['CreateTime'], content)
+        call_next(message)
+
+    def search_messages(self, query, chatroom=None, sender=None, since=None, until=None, limit=20):
+        return self.message_index.search(query, chatroom, sender, since, until, limit)
+
     def send_text(self, content, to_contact):
         message = Message(
             content=content, type=config.MessageType.TEXT.value,
             from_username=self.user.username, to_username=to_contact.username
         )
-        return self._send_message(message)
+        return self.outbox.submit(message)
 
+    def send_image(self, file, to_contact):
+        media = self.media_uploader.upload(file, to_contact.username, media_type='pic')
+        message = Message(
+            content='', type=config.MessageType.IMAGE.value,
+            from_username=self.user.username, to_username=to_contact.username, media_id=media.media_id
+        )
+        return self.outbox.submit(message)
+
+    def send_file(self, file, to_contact):
+        media = self.media_uploader.upload(file, to_contact.username, media_type='doc')
+        content = APPMSG_FILE_TEMPLATE.format(
+            title=escape(media.name), size=media.size, media_id=media.media_id,
+            ext=os.path.splitext(media.name)[1].lstrip('.'),
+        )
+        message = Message(
+            content=content, type=config.MessageType.APPMSG.value,
+            from_username=self.user.username, to_username=to_contact.username, media_id=media.media_id
+        )
+        return self.outbox.submit(message)
+
+    def broadcast(self, content, recipients, checkpoint=None, concurrency=config.BROADCAST_CONCURRENCY,
+                  rate=None):
+        return Broadcast(self, content, recipients, checkpoint, concurrency, rate).run()
+
+    @traced('send', lambda self, message: {'to': message.to_username, 'type': message.type})
     def _send_message(self, message):
         params = {'pass_ticket': self.pass_ticket}
         data = self._gen_base_request()
-        local_id = gen_client_msg_id()
+        local_id = message.client_msg_id or gen_client_msg_id()
         data.update({
             'Msg': {
                 'ClientMsgId': local_id,
@@ -338,9 +732,22 @@ class WXClient(object):
             'Scene': 0
         })
         send_message_api = config.WX_SEND_TEXT_MESSAGE_URL
-        res = self.session.post(send_message_api, params=params, json=data)
+        if message.type == config.MessageType.IMAGE:
+            send_message_api = config.WX_SEND_IMG_MESSAGE_URL
+            params.update({'fun': 'async', 'f': 'json'})
+            data['Msg']['MediaId'] = message.media_id
+        elif message.type == config.MessageType.APPMSG:
+            send_message_api = config.WX_SEND_APPMSG_MESSAGE_URL
+            params.update({'fun': 'async', 'f': 'json'})
+        res = self._request('POST', send_message_api, params=params, json=data)
         return res
 
+    def _upload_chunk(self, form, file):
+        res = self._request(
+            'POST', config.WX_UPLOAD_MEDIA_URL, params={'f': 'json'}, data=form, files={'filename': file}
+        )
+        return res.json()
+
     def _gen_base_request(self):
         return {
             'BaseRequest': {
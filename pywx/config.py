@@ -3,7 +3,6 @@ from __future__ import unicode_literals
 
 import re
 import os.path
-from logging import config
 
 import enum
 
@@ -20,15 +19,127 @@ DEFAULT_USER_AGENT = (
 DEFAULT_HEADERS = {
     'User-Agent': DEFAULT_USER_AGENT
 }
-DEFAULT_TIMEOUT = 1
+CONNECT_TIMEOUT = 5
+# Read timeout of endpoints missing from ENDPOINT_TIMEOUTS.
+DEFAULT_TIMEOUT = 10
+SESSION_CHECK_TIMEOUT = 3
+# synccheck is held open for about 25 seconds when there is nothing new.
+SYNC_CHECK_TIMEOUT = 35
+ENDPOINT_TIMEOUTS = {
+    'jslogin': 5,
+    'qrcode': 10,
+    # The login check is long-polled too.
+    'login': 35,
+    'webwxnewloginpage': 10,
+    'webwxinit': 30,
+    'webwxstatusnotify': 10,
+    'webwxgetcontact': 60,
+    'webwxbatchgetcontact': 30,
+    'synccheck': SYNC_CHECK_TIMEOUT,
+    'webwxsync': 30,
+    'webwxsendmsg': 10,
+    'webwxsendmsgimg': 10,
+    'webwxsendappmsg': 10,
+    'webwxuploadmedia': 60,
+    'webwxgetmsgimg': 60,
+    'webwxgetvoice': 60,
+    'webwxgetvideo': 120,
+    'webwxlogout': 5,
+}
+# Endpoints served from the long-poll pool, apart from API and media traffic.
+LONGPOLL_ENDPOINTS = ('synccheck', 'login')
+SYNC_MIN_INTERVAL = 1
+SYNC_BACKOFF_BASE = 1
+SYNC_BACKOFF_MAX = 60
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 100
+# Each account holds at most one long-poll open at a time.
+LONGPOLL_POOL_MAXSIZE = 2
+# Bytes read at a time when decoding large JSON responses.
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+# Contacts
+# Total chatroom members kept loaded before cold chatrooms are evicted.
+CHATROOM_MEMBER_BUDGET = 100000
+# webwxbatchgetcontact chunks start at BATCH_CHUNK_SIZE usernames and shrink to BATCH_CHUNK_MIN
+# when responses take longer than BATCH_TARGET_LATENCY seconds or carry more than
+# BATCH_TARGET_ENTRIES contacts and members.
+BATCH_CHUNK_SIZE = 50
+BATCH_CHUNK_MIN = 5
+BATCH_CHUNK_STEP = 5
+BATCH_TARGET_LATENCY = 2
+BATCH_TARGET_ENTRIES = 10000
+BATCH_FETCH_CONCURRENCY = 8
+BATCH_FETCH_RETRIES = 3
+BATCH_BACKOFF_BASE = 0.5
+
+
+# Message handling
+# Messages from one FromUserName always go to the same worker, in order.
+WORKER_POOL_SIZE = 4
+WORKER_QUEUE_SIZE = 1000
+# Recently seen MsgIds kept (and saved with the session) to drop redelivered messages.
+MSGID_DEDUP_WINDOW = 2000
+# Set to keep a rotating Bloom filter of about this many older MsgIds per generation.
+MSGID_BLOOM_CAPACITY = None
+MSGID_BLOOM_ERROR_RATE = 0.001
+
+# Message log
+MESSAGE_LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+MESSAGE_LOG_BATCH_SIZE = 500
+MESSAGE_LOG_QUEUE_SIZE = 10000
+
+# Search
+SEARCH_COMMIT_BATCH = 200
+SEARCH_COMMIT_INTERVAL = 1
+
+
+# Sending
+# Token bucket pacing of outgoing messages, in messages per second.
+SEND_RATE = 2
+SEND_BURST = 10
+SEND_RETRIES = 3
+SEND_BACKOFF_BASE = 1
+SEND_WORKERS = 4
+SEND_QUEUE_SIZE = 1000
+# Recent ClientMsgIds remembered to drop duplicate sends.
+SEND_DEDUP_WINDOW = 10000
+# BaseResponse.Ret values worth retrying: 1205 is the frequency limit.
+SEND_RETRY_RETS = (1205,)
+# Sends a broadcast keeps queued in the outbox at once.
+BROADCAST_CONCURRENCY = 100
+# Media uploads go to webwxuploadmedia in chunks of this size, several at a time.
+MEDIA_CHUNK_SIZE = 512 * 1024
+MEDIA_UPLOAD_CONCURRENCY = 4
+MEDIA_UPLOAD_RETRIES = 3
+MEDIA_UPLOAD_BACKOFF_BASE = 1
+# Uploaded files whose MediaId is remembered for reuse.
+MEDIA_ID_CACHE_SIZE = 1000
+# Bytes of downloaded message media kept before the least recently used are removed.
+MEDIA_CACHE_SIZE = 1024 * 1024 * 1024
+MEDIA_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# Metrics
+# Histogram upper bounds in seconds.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Independently locked shards the metrics are spread over, assigned to threads in turn.
+METRICS_SHARDS = 16
+# Seconds between stack samples of the sampling profiler.
+PROFILER_INTERVAL = 0.005
 
 
 # Wechat API
 WX_BASE_URL = 'https://wx.qq.com'
 WX_LOGIN_URL = 'https://login.wx.qq.com'
 WX_WEBPUSH_URL = 'https://webpush.wx.qq.com'
+WX_FILE_URL = 'https://file.wx.qq.com'
 WX_CGI_PATH = 'cgi-bin/mmwebwx-bin'
 WX_QRIMG_BASE_URL = os.path.join(WX_LOGIN_URL, 'qrcode')
+# The login QR code encodes this URL followed by the uuid.
+WX_QR_LOGIN_URL = 'https://login.weixin.qq.com/l/'
 WX_JSLOING_URL = os.path.join(WX_LOGIN_URL, 'jslogin')
 WX_LOING_CHECK_URL = os.path.join(WX_LOGIN_URL, WX_CGI_PATH, 'login')
 WX_LOGOUT_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxlogout')
@@ -42,6 +153,10 @@ WX_SEND_TEXT_MESSAGE_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxsendmsg'
 WX_SEND_IMG_MESSAGE_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxsendmsgimg')
 WX_SEND_EMOTION_MESSAGE_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxsendemoticon')
 WX_SEND_APPMSG_MESSAGE_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxsendappmsg')
+WX_UPLOAD_MEDIA_URL = os.path.join(WX_FILE_URL, WX_CGI_PATH, 'webwxuploadmedia')
+WX_GET_MSG_IMG_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxgetmsgimg')
+WX_GET_VOICE_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxgetvoice')
+WX_GET_VIDEO_URL = os.path.join(WX_BASE_URL, WX_CGI_PATH, 'webwxgetvideo')
 
 
 # Regex
@@ -51,6 +166,10 @@ RE_JSLOGING_PATTERN = re.compile(
 RE_LOGING_CHECK_PATTERN = re.compile(r'window.code=200;\nwindow.redirect_uri="(?P<redirect_url>.+?)"')
 RE_SYNC_CHECK_PATTERN = re.compile(r'window.synccheck={retcode:"(?P<retcode>\d+)",selector:"(?P<selector>\d+)"}')
 
+# synccheck retcodes meaning the session is gone: logged out on the phone,
+# logged in elsewhere, or expired.
+SYNC_LOGOUT_RETCODES = (1100, 1101, 1102)
+
 
 class StatusNotifyCode(enum.IntEnum):
     ENTER_SESSION = 2
@@ -105,4 +224,9 @@ LOGGING_CONFIG = {
     }
 }
 
-config.dictConfig(LOGGING_CONFIG)
+
+def configure_logging(logging_config=LOGGING_CONFIG):
+    """Applies ``LOGGING_CONFIG``, importing pywx leaves logging untouched."""
+    import logging.config
+
+    logging.config.dictConfig(logging_config)
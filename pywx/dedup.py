@@ -0,0 +1,93 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import math
+from collections import OrderedDict
+
+from pywx import config
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=config.MSGID_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) * math.log(2))))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        h1 = hash(key)
+        h2 = hash((key, 0x5bd1e995)) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        array = self._array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class MessageDeduplicator(object):
+    """Drops messages whose ``MsgId`` was seen recently.
+
+    The last ``window`` ids are kept exactly.  With ``bloom_capacity`` ids
+    falling out of the window go to a Bloom filter; two generations of
+    ``bloom_capacity`` ids each are kept, so the horizon is longer at a fixed
+    memory cost and a small false positive rate.
+    """
+
+    def __init__(self, window=config.MSGID_DEDUP_WINDOW, bloom_capacity=config.MSGID_BLOOM_CAPACITY):
+        self.window = window
+        self.bloom_capacity = bloom_capacity
+        self.seen = 0
+        self.duplicates = 0
+        self._recent = OrderedDict()
+        self._blooms = []
+
+    def __len__(self):
+        return len(self._recent)
+
+    def is_duplicate(self, msg_id):
+        """Records ``msg_id`` and tells whether it was seen before."""
+        self.seen += 1
+        if msg_id in self._recent or any(msg_id in bloom for bloom in self._blooms):
+            self.duplicates += 1
+            return True
+        self._recent[msg_id] = None
+        while len(self._recent) > self.window:
+            evicted, _ = self._recent.popitem(last=False)
+            if self.bloom_capacity:
+                self._remember(evicted)
+        return False
+
+    def filter(self, messages):
+        for message in messages:
+            if not self.is_duplicate(message['MsgId']):
+                yield message
+
+    def stats(self):
+        return {
+            'seen': self.seen,
+            'duplicates': self.duplicates,
+            'window': len(self._recent),
+            'bloom': sum(bloom.count for bloom in self._blooms),
+        }
+
+    def dump(self):
+        return list(self._recent)
+
+    def load(self, msg_ids):
+        for msg_id in msg_ids:
+            self._recent[msg_id] = None
+        while len(self._recent) > self.window:
+            self._recent.popitem(last=False)
+
+    def _remember(self, msg_id):
+        if not self._blooms or self._blooms[-1].count >= self.bloom_capacity:
+            self._blooms = self._blooms[-1:] + [BloomFilter(self.bloom_capacity)]
+        self._blooms[-1].add(msg_id)
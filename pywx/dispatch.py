@@ -0,0 +1,145 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import re
+import sys
+from collections import defaultdict
+
+import six
+
+
+logger = logging.getLogger(__name__)
+
+
+def _call(handler, message):
+    try:
+        handler(message)
+    except Exception:
+        logger.exception('handler %r failed', handler)
+
+
+class _TypeHandlers(object):
+    """Runs every matching handler, then raises the first failure.
+
+    One failing handler must not keep the others from seeing the message,
+    but the failure still reaches the middleware and the worker pool.
+    """
+
+    def __init__(self):
+        self.default = None
+        self.any = []
+        self.chatroom = []
+        self.by_sender = defaultdict(list)
+
+    def __call__(self, message):
+        errors = []
+        if self.default is not None:
+            self._call(self.default, message, errors)
+        from_username = message['FromUserName']
+        candidates = self.any
+        if from_username.startswith('@@') and self.chatroom:
+            candidates = candidates + self.chatroom
+        if from_username in self.by_sender:
+            candidates = candidates + self.by_sender[from_username]
+        for handler, pattern in candidates:
+            if pattern is None or pattern.search(message['Content']):
+                self._call(handler, message, errors)
+        if errors:
+            for exc_info in errors[1:]:
+                logger.error('handler failed', exc_info=exc_info)
+            six.reraise(*errors[0])
+
+    def _call(self, handler, message, errors):
+        try:
+            handler(message)
+        except Exception:
+            errors.append(sys.exc_info())
+
+
+class HandlerRegistry(object):
+    """Maps ``MsgType`` to handlers, filters and middleware.
+
+    Handlers are indexed by type, sender and chatroom-ness when they are
+    registered, so dispatching a message only looks at the handlers that can
+    match it.  Middleware is called as ``middleware(message, call_next)``.
+    Contact change events from :mod:`pywx.events` go to ``on_change``
+    handlers for their type or for all types.
+    """
+
+    def __init__(self):
+        self._types = defaultdict(_TypeHandlers)
+        self._middlewares = []
+        self._type_middlewares = defaultdict(list)
+        self._chains = {}
+        self._change_handlers = defaultdict(list)
+
+    def set_default(self, message_type, handler):
+        self._types[message_type].default = handler
+        self._rebuild()
+
+    def add(self, handler, message_type, chatroom_only=False, from_contact=None, pattern=None):
+        if isinstance(pattern, six.string_types):
+            pattern = re.compile(pattern)
+        handlers = self._types[message_type]
+        if from_contact is not None:
+            username = getattr(from_contact, 'username', from_contact)
+            handlers.by_sender[username].append((handler, pattern))
+        elif chatroom_only:
+            handlers.chatroom.append((handler, pattern))
+        else:
+            handlers.any.append((handler, pattern))
+        self._rebuild()
+
+    def on(self, message_type, chatroom_only=False, from_contact=None, pattern=None):
+        def decorator(handler):
+            self.add(handler, message_type, chatroom_only, from_contact, pattern)
+            return handler
+        return decorator
+
+    def add_middleware(self, middleware, message_type=None):
+        if message_type is None:
+            self._middlewares.append(middleware)
+        else:
+            self._type_middlewares[message_type].append(middleware)
+        self._rebuild()
+
+    def middleware(self, message_type=None):
+        def decorator(middleware):
+            self.add_middleware(middleware, message_type)
+            return middleware
+        return decorator
+
+    def add_change_handler(self, handler, event_type=None):
+        self._change_handlers[event_type].append(handler)
+
+    def on_change(self, event_type=None):
+        def decorator(handler):
+            self.add_change_handler(handler, event_type)
+            return handler
+        return decorator
+
+    def dispatch_change(self, event):
+        # A failing handler must not abort the sync delta the event came from.
+        for handler in self._change_handlers.get(type(event), ()):
+            _call(handler, event)
+        for handler in self._change_handlers.get(None, ()):
+            _call(handler, event)
+
+    def dispatch(self, message):
+        chain = self._chains.get(message['MsgType'])
+        if chain is not None:
+            chain(message)
+
+    def _rebuild(self):
+
+        def _wrap(middleware, call_next):
+            return lambda message: middleware(message, call_next)
+
+        chains = {}
+        for message_type, handlers in self._types.items():
+            chain = handlers
+            for middleware in reversed(self._middlewares + self._type_middlewares[message_type]):
+                chain = _wrap(middleware, chain)
+            chains[message_type] = chain
+        self._chains = chains
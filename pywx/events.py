@@ -0,0 +1,15 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+
+ContactAdded = namedtuple('ContactAdded', ('contact',))
+
+# ``changes`` maps each changed field to its ``(old, new)`` values.
+ContactUpdated = namedtuple('ContactUpdated', ('contact', 'changes'))
+
+ContactRemoved = namedtuple('ContactRemoved', ('contact',))
+
+# ``added``/``removed``/``updated`` are lists of ChatroomMember.
+MembersChanged = namedtuple('MembersChanged', ('chatroom', 'added', 'removed', 'updated'))
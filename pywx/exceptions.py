@@ -1 +1,32 @@
 # coding: utf-8
+
+
+class WXError(Exception):
+    pass
+
+
+class TransportError(WXError):
+    pass
+
+
+class TransportTimeout(TransportError):
+    pass
+
+
+class SendError(WXError):
+
+    def __init__(self, ret):
+        super(SendError, self).__init__('send failed with Ret %s' % ret)
+        self.ret = ret
+
+
+class SendTimeout(WXError):
+    pass
+
+
+class OutboxStopped(WXError):
+    pass
+
+
+class UploadError(WXError):
+    pass
@@ -0,0 +1,98 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import codecs
+import json
+
+
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader(object):
+
+    def __init__(self, chunks, encoding):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        try:
+            text = self._decoder.decode(next(self._chunks))
+        except StopIteration:
+            text = self._decoder.decode(b'', final=True)
+            self.eof = True
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def take(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # A number running into the end of the buffer may continue in the next chunk.
+            if end < len(self.buf) or self.eof:
+                self.pos = end
+                return value
+            self.fill()
+
+
+def iter_json_object(chunks, stream_keys=(), encoding='utf-8'):
+    """Incrementally decode a JSON object from an iterable of byte chunks.
+
+    Yields ``(key, value)`` for every top-level member.  Arrays under
+    ``stream_keys`` are yielded one ``(key, item)`` per element, so only one
+    element is decoded and held at a time.
+    """
+    reader = _Reader(chunks, encoding)
+    if reader.take() != '{':
+        raise ValueError('Expecting object')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        if reader.take() != ':':
+            raise ValueError('Expecting : delimiter')
+        if key in stream_keys and reader.peek() == '[':
+            reader.take()
+            if reader.peek() == ']':
+                reader.take()
+            else:
+                while True:
+                    yield key, reader.value()
+                    char = reader.take()
+                    if char == ']':
+                        break
+                    if char != ',':
+                        raise ValueError('Expecting , delimiter')
+        else:
+            yield key, reader.value()
+        char = reader.take()
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('Expecting , delimiter')
@@ -0,0 +1,200 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import os.path
+import threading
+from collections import OrderedDict, namedtuple
+
+import six
+
+from pywx import config
+from pywx.exceptions import TransportError, UploadError
+from pywx.utils import backoff_delay, gen_client_msg_id, timestamp_now
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+UploadedMedia = namedtuple('UploadedMedia', ('media_id', 'name', 'size', 'digest'))
+
+
+class MediaUploader(object):
+    """Uploads files to ``webwxuploadmedia`` in chunks.
+
+    The file is read once, ``chunk_size`` bytes at a time, and hashed as it
+    is read.  Every chunk but the last is uploaded by up to ``concurrency``
+    workers and retried on its own when it fails; the last chunk, which
+    completes the upload, is sent once the others are in, carrying the MD5
+    of the whole file.  Uploaded paths are remembered by size, mtime and
+    media type, so sending the same file again the same way reuses its
+    MediaId.
+    """
+
+    def __init__(self, client, chunk_size=config.MEDIA_CHUNK_SIZE, concurrency=config.MEDIA_UPLOAD_CONCURRENCY,
+                 retries=config.MEDIA_UPLOAD_RETRIES):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.uploads = 0
+        self.reused = 0
+        self._media_ids = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_seq = 0
+
+    def upload(self, file, to_username, media_type='doc'):
+        """Uploads a path or binary file object from its current position."""
+        if isinstance(file, six.string_types):
+            with io.open(file, 'rb') as fd:
+                return self.upload(fd, to_username, media_type)
+
+        name = os.path.basename(getattr(file, 'name', None) or 'file')
+        size, stat_key = self._stat(file)
+        key = stat_key + (media_type,) if stat_key is not None else None
+        cached = self._cached(key)
+        if cached is not None:
+            self.reused += 1
+            return UploadedMedia(cached[0], name, size, cached[1])
+
+        with self._lock:
+            file_id = 'WU_FILE_%d' % self._file_seq
+            self._file_seq += 1
+        upload = _Upload(self, file_id, name, size, to_username, media_type)
+        media_id, digest = upload.run(file)
+
+        with self._lock:
+            self.uploads += 1
+            if key is not None:
+                self._remember(key, (media_id, digest))
+        return UploadedMedia(media_id, name, size, digest)
+
+    def stats(self):
+        return {'uploads': self.uploads, 'reused': self.reused, 'cached': len(self._media_ids)}
+
+    def _stat(self, file):
+        try:
+            stat = os.fstat(file.fileno())
+        except (AttributeError, IOError, OSError, io.UnsupportedOperation):
+            position = file.tell()
+            file.seek(0, os.SEEK_END)
+            size = file.tell() - position
+            file.seek(position)
+            return size, None
+        name = getattr(file, 'name', None)
+        key = (os.path.realpath(name), stat.st_size, stat.st_mtime) if isinstance(name, six.string_types) else None
+        return stat.st_size - file.tell(), key
+
+    def _cached(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            return self._media_ids.get(key)
+
+    def _remember(self, key, value):
+        self._media_ids.pop(key, None)
+        self._media_ids[key] = value
+        while len(self._media_ids) > config.MEDIA_ID_CACHE_SIZE:
+            self._media_ids.popitem(last=False)
+
+
+class _Upload(object):
+
+    def __init__(self, uploader, file_id, name, size, to_username, media_type):
+        self.uploader = uploader
+        self.client = uploader.client
+        self.file_id = file_id
+        self.name = name
+        self.size = size
+        self.to_username = to_username
+        self.media_type = media_type
+        self.mime = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client_media_id = gen_client_msg_id()
+        self.chunks = max(1, (size + uploader.chunk_size - 1) // uploader.chunk_size)
+        self.errors = []
+
+    def run(self, file):
+        digest = hashlib.md5()
+        queue = self.client.queue_class(self.uploader.concurrency)
+        workers = min(self.uploader.concurrency, self.chunks - 1)
+        for _ in range(workers):
+            self.client._spawn(self._work, queue)
+
+        last = None
+        for index in range(self.chunks):
+            data = file.read(self.uploader.chunk_size)
+            digest.update(data)
+            if index == self.chunks - 1:
+                last = data
+                break
+            queue.put((index, data))
+        for _ in range(workers):
+            queue.put(_STOP)
+        queue.join()
+        if self.errors:
+            raise UploadError('upload of %s failed: %s' % (self.name, self.errors[0]))
+
+        response = self._send_chunk(self.chunks - 1, last, digest.hexdigest())
+        if not response.get('MediaId'):
+            raise UploadError('upload of %s was not completed' % self.name)
+        return response['MediaId'], digest.hexdigest()
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if not self.errors:
+                    self._send_chunk(*item)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                queue.task_done()
+
+    def _send_chunk(self, index, data, md5=''):
+        error = None
+        for attempt in range(self.uploader.retries + 1):
+            if attempt:
+                self.client.sleep(backoff_delay(attempt, config.MEDIA_UPLOAD_BACKOFF_BASE))
+            try:
+                result = self.client._upload_chunk(self._form(index, md5), (self.name, data, self.mime))
+            except (TransportError, ValueError) as e:
+                error = e
+                continue
+            if result['BaseResponse']['Ret'] == 0:
+                return result
+            error = UploadError(
+                'chunk %d of %s failed with Ret %s' % (index, self.name, result['BaseResponse']['Ret'])
+            )
+        logger.warning('upload of chunk %d of %s failed: %r', index, self.name, error)
+        raise error
+
+    def _form(self, index, md5):
+        upload_request = dict(
+            self.client._gen_base_request(),
+            UploadType=2, ClientMediaId=self.client_media_id, TotalLen=self.size, StartPos=0,
+            DataLen=self.size, MediaType=4, FromUserName=self.client.user.username,
+            ToUserName=self.to_username, FileMd5=md5,
+        )
+        form = {
+            'id': self.file_id,
+            'name': self.name,
+            'type': self.mime,
+            'lastModifiedDate': '%d' % timestamp_now(),
+            'size': '%d' % self.size,
+            'mediatype': self.media_type,
+            'uploadmediarequest': json.dumps(upload_request),
+            'webwx_data_ticket': self.client.transport.cookies.get('webwx_data_ticket', ''),
+            'pass_ticket': self.client.pass_ticket,
+        }
+        if self.chunks > 1:
+            form['chunks'] = '%d' % self.chunks
+            form['chunk'] = '%d' % index
+        return form
@@ -0,0 +1,171 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import os.path
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from pywx import config
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    msg_id TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_digest ON messages (digest);
+'''
+
+
+class MediaCache(object):
+    """Content-addressed store of downloaded message media.
+
+    Files are kept under ``objects/`` by SHA-1, so the same sticker or image
+    received in many messages is stored once, and a SQLite index maps each
+    ``MsgId`` to its digest.  Once more than ``max_bytes`` are stored the
+    least recently used files are removed.  Concurrent fetches of the same
+    ``MsgId`` share one download.
+    """
+
+    def __init__(self, directory, max_bytes=config.MEDIA_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.downloads = 0
+        self.evictions = 0
+        self._tmp_dir = os.path.join(directory, 'tmp')
+        for path in (directory, self._tmp_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._objects = OrderedDict()
+        for digest, size in self._db.execute('SELECT digest, size FROM objects ORDER BY accessed'):
+            self._objects[digest] = size
+            self.size += size
+
+    def path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def get(self, msg_id):
+        """Returns the path of a message's media if it is stored."""
+        with self._lock:
+            return self._get(msg_id)
+
+    def fetch(self, msg_id, download, event_class=threading.Event):
+        """Returns the path of a message's media, storing the chunks yielded
+        by ``download()`` when it is not stored yet.  Callers waiting on
+        another's download block on an ``event_class`` instance."""
+        while True:
+            with self._lock:
+                path = self._get(msg_id)
+                if path is not None:
+                    self.hits += 1
+                    return path
+                event = self._loading.get(msg_id)
+                leader = event is None
+                if leader:
+                    event = self._loading[msg_id] = event_class()
+
+            if not leader:
+                # Look again once the leader is done, or take over if it failed.
+                event.wait()
+                continue
+
+            try:
+                return self._store(msg_id, download())
+            finally:
+                with self._lock:
+                    del self._loading[msg_id]
+                event.set()
+
+    def stats(self):
+        return {
+            'objects': len(self._objects),
+            'bytes': self.size,
+            'hits': self.hits,
+            'downloads': self.downloads,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _get(self, msg_id):
+        row = self._db.execute('SELECT digest FROM messages WHERE msg_id = ?', (msg_id,)).fetchone()
+        if row is None or row[0] not in self._objects:
+            return None
+        digest = row[0]
+        self._objects[digest] = self._objects.pop(digest)
+        with self._db:
+            self._db.execute('UPDATE objects SET accessed = ? WHERE digest = ?', (time.time(), digest))
+        return self.path(digest)
+
+    def _store(self, msg_id, chunks):
+        sha1 = hashlib.sha1()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    sha1.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            digest = sha1.hexdigest()
+            path = self.path(digest)
+
+            with self._lock:
+                self.downloads += 1
+                if digest in self._objects:
+                    os.remove(tmp_path)
+                else:
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    os.rename(tmp_path, path)
+                    self._objects[digest] = size
+                    self.size += size
+                with self._db:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO objects (digest, size, accessed) VALUES (?, ?, ?)',
+                        (digest, size, time.time())
+                    )
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO messages (msg_id, digest) VALUES (?, ?)', (msg_id, digest)
+                    )
+                self._objects[digest] = self._objects.pop(digest)
+                self._evict(keep=digest)
+            return path
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self, keep):
+        with self._db:
+            while self.size > self.max_bytes and len(self._objects) > 1:
+                digest, size = next(iter(self._objects.items()))
+                if digest == keep:
+                    break
+                del self._objects[digest]
+                self.size -= size
+                self.evictions += 1
+                self._db.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+                self._db.execute('DELETE FROM messages WHERE digest = ?', (digest,))
+                try:
+                    os.remove(self.path(digest))
+                except OSError:
+                    pass
@@ -0,0 +1,87 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from pywx import config
+
+
+class ChatroomMemberCache(object):
+    """LRU of loaded chatroom member lists, bounded by total member count.
+
+    Member lists are fetched on first access; concurrent loads of the same
+    chatroom share one request, and a failed one is retried on next access.  Evicted chatrooms drop their members and
+    load them again when next accessed, and once the contacts' interned
+    usernames outnumber the loaded members twice over they are rebuilt from
+    the loaded chatrooms.
+    """
+
+    def __init__(self, client, max_members=config.CHATROOM_MEMBER_BUDGET):
+        self.client = client
+        self.max_members = max_members
+        self.size = 0
+        self._chatrooms = OrderedDict()
+        self._lock = client.lock_class()
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._chatrooms)
+
+    def load(self, chatroom):
+        with self._lock:
+            if chatroom.members_loaded:
+                self._track(chatroom)
+                return
+            event = self._loading.get(chatroom.username)
+            leader = event is None
+            if leader:
+                event = self._loading[chatroom.username] = self.client.event_class()
+
+        if not leader:
+            event.wait()
+            return
+
+        try:
+            members = self.client._fetch_chatroom_members(chatroom)
+            # A failed fetch leaves the chatroom unloaded, the next access tries again.
+            if members is None:
+                return
+            chatroom.load_members(members)
+            with self._lock:
+                self._track(chatroom)
+        finally:
+            with self._lock:
+                del self._loading[chatroom.username]
+            event.set()
+
+    def add(self, chatroom):
+        with self._lock:
+            self._track(chatroom)
+
+    def discard(self, chatroom):
+        with self._lock:
+            tracked = self._chatrooms.pop(chatroom.username, None)
+            if tracked is not None:
+                self.size -= tracked[1]
+                self._compact()
+
+    def _track(self, chatroom):
+        tracked = self._chatrooms.pop(chatroom.username, None)
+        if tracked is not None:
+            self.size -= tracked[1]
+        count = chatroom.member_count
+        self._chatrooms[chatroom.username] = (chatroom, count)
+        self.size += count
+        evicted = 0
+        while self.size > self.max_members and len(self._chatrooms) > 1:
+            _, (chatroom, count) = self._chatrooms.popitem(last=False)
+            self.size -= count
+            chatroom.unload_members()
+            evicted += 1
+        if evicted:
+            self._compact()
+
+    def _compact(self):
+        contacts = self.client.contacts
+        if contacts.interned > 2 * self.size:
+            contacts.compact_interned(chatroom for chatroom, _ in self._chatrooms.values())
@@ -0,0 +1,195 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import itertools
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from pywx import config
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': list(zip(self.bounds, self.counts)),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class _Shard(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.histograms = {}
+
+
+class Metrics(object):
+    """Counters and histograms of a client's HTTP calls and message handling.
+
+    Each thread (or greenlet) is assigned one of ``METRICS_SHARDS`` shards
+    in turn, so concurrent writers rarely share a lock; ``snapshot`` merges
+    the shards.
+    """
+
+    def __init__(self, shards=config.METRICS_SHARDS):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+
+    def _update(self, counters=(), histogram=None, bounds=None, value=None):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._next_shard) % len(self._shards)]
+        with shard.lock:
+            for key in counters:
+                shard.counters[key] += 1
+            if histogram is not None:
+                hist = shard.histograms.get(histogram)
+                if hist is None:
+                    hist = shard.histograms[histogram] = Histogram(bounds)
+                hist.observe(value)
+
+    def observe_request(self, endpoint, seconds, error=False):
+        counters = (('requests', endpoint), ('errors', endpoint)) if error else (('requests', endpoint),)
+        self._update(counters, ('request', endpoint), config.METRICS_LATENCY_BUCKETS, seconds)
+
+    def observe_sync_lag(self, seconds):
+        self._update((), ('sync_lag', None), config.METRICS_LAG_BUCKETS, max(seconds, 0.0))
+
+    def observe_message(self, message_type, seconds):
+        self._update(
+            (('messages', message_type),), ('handler', message_type), config.METRICS_LATENCY_BUCKETS, seconds
+        )
+
+    def _merged(self):
+        counters = defaultdict(int)
+        histograms = {}
+        for shard in self._shards:
+            with shard.lock:
+                for key, value in shard.counters.items():
+                    counters[key] += value
+                for key, hist in shard.histograms.items():
+                    if key not in histograms:
+                        histograms[key] = Histogram(hist.bounds)
+                    histograms[key].merge(hist)
+        return counters, histograms
+
+    def snapshot(self):
+        counters, histograms = self._merged()
+        snapshot = {'requests': {}, 'messages': {}, 'handlers': {}, 'sync_lag': None}
+        for (kind, label), hist in histograms.items():
+            if kind == 'request':
+                snapshot['requests'][label] = dict(
+                    hist.as_dict(), requests=counters[('requests', label)], errors=counters[('errors', label)]
+                )
+            elif kind == 'handler':
+                snapshot['handlers'][label] = hist.as_dict()
+            else:
+                snapshot['sync_lag'] = hist.as_dict()
+        for (kind, label), value in counters.items():
+            if kind == 'messages':
+                snapshot['messages'][label] = value
+        return snapshot
+
+    def render_prometheus(self):
+        counters, histograms = self._merged()
+        lines = []
+
+        def _type_label(message_type):
+            try:
+                return config.MessageType(message_type).name.lower()
+            except ValueError:
+                return '%s' % message_type
+
+        def _counter(name, kind, label_name, format_label=lambda label: label):
+            lines.append('# TYPE %s counter' % name)
+            for (counter_kind, label), value in sorted(counters.items()):
+                if counter_kind == kind:
+                    lines.append('%s{%s="%s"} %d' % (name, label_name, format_label(label), value))
+
+        def _histogram(name, kind, label_name=None, format_label=lambda label: label):
+            lines.append('# TYPE %s histogram' % name)
+            for (hist_kind, label), hist in sorted(histograms.items()):
+                if hist_kind != kind:
+                    continue
+                labels = '%s="%s",' % (label_name, format_label(label)) if label_name else ''
+                cumulative = 0
+                for bound, count in zip(hist.bounds, hist.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, bound, cumulative))
+                lines.append('%s_bucket{%sle="+Inf"} %d' % (name, labels, hist.count))
+                labels = '{%s}' % labels.rstrip(',') if labels else ''
+                lines.append('%s_sum%s %f' % (name, labels, hist.sum))
+                lines.append('%s_count%s %d' % (name, labels, hist.count))
+
+        _counter('pywx_http_requests_total', 'requests', 'endpoint')
+        _counter('pywx_http_errors_total', 'errors', 'endpoint')
+        _histogram('pywx_http_request_duration_seconds', 'request', 'endpoint')
+        _histogram('pywx_sync_lag_seconds', 'sync_lag')
+        _counter('pywx_messages_total', 'messages', 'type', _type_label)
+        _histogram('pywx_handler_duration_seconds', 'handler', 'type', _type_label)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves ``render_prometheus`` at ``/metrics`` from a daemon thread."""
+        from six.moves import BaseHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', '%d' % len(body))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return server
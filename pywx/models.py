@@ -1,7 +1,9 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
-from collections import namedtuple
+import bisect
+import threading
+from collections import defaultdict, namedtuple
 
 from pywx.utils import (
     is_chatroom, is_mp, is_friend
@@ -12,9 +14,16 @@ User = namedtuple(
     'User', ('uin', 'username', 'nickname', 'raw')
 )
 
+CONTACT_FIELDS = (
+    'username', 'sex', 'nickname', 'alias', 'remarkname', 'encry_chatroom_id', 'province', 'city'
+)
+MEMBER_FIELDS = ('username', 'display_name', 'nickname')
+
 
 class Contact(object):
 
+    __slots__ = ('client',) + CONTACT_FIELDS
+
     def __init__(self, client, username, sex=0, nickname=None, alias=None,
                  remarkname=None, encry_chatroom_id=None, province=None, city=None):
         self.client = client
@@ -40,78 +49,118 @@ class Contact(object):
             else:
                 return SystemContact
 
+        # Members of different chatrooms share one string per username.
+        intern = client.contacts.intern if client is not None else None
         klass = _get_contact_class(contact)
+        username = contact['UserName']
         instance = klass(
-            client=client, username=contact['UserName'], sex=contact['Sex'],
+            client=client, username=intern(username) if intern else username, sex=contact['Sex'],
             nickname=contact['NickName'], alias=contact['Alias'],
             remarkname=contact['RemarkName'], encry_chatroom_id=contact['EncryChatRoomId'],
             province=contact['Province'], city=contact['City']
         )
 
-        if klass == ChatroomContact:
-            for member in contact['MemberList']:
-                member = ChatroomMember.from_wx_member(member)
-                instance.add_member(member)
+        # An empty MemberList means the members were not sent, they load on first access.
+        if klass == ChatroomContact and contact['MemberList']:
+            instance.load_members(
+                ChatroomMember.from_wx_member(member, intern=intern) for member in contact['MemberList']
+            )
 
         return instance
 
 
 class FriendContact(Contact):
-    pass
+    __slots__ = ()
 
 
 class MPContact(Contact):
-    pass
+    __slots__ = ()
 
 
 class SystemContact(Contact):
-    pass
+    __slots__ = ()
 
 
 class ChatroomContact(Contact):
 
+    __slots__ = ('_members',)
+
     def __init__(self, *args, **kwargs):
         super(ChatroomContact, self).__init__(*args, **kwargs)
-        self._members = {}
+        self._members = None
 
     @property
     def is_owner(self):
         return self.username == self.client.username
 
+    @property
+    def members_loaded(self):
+        return self._members is not None
+
+    @property
+    def member_count(self):
+        return len(self._members) if self._members is not None else 0
+
     @property
     def members(self):
-        return self._members.values()
+        self.client.chatroom_members.load(self)
+        return list((self._members or {}).values())
 
     @property
     def strangers(self):
         return filter(lambda m: m.username not in self.client.contacts, self.members)
 
     def add_member(self, member):
+        if self._members is None:
+            self._members = {}
         self._members[member.username] = member
 
+    def get_member(self, username):
+        return (self._members or {}).get(username)
+
     def remove_member(self, member):
+        if self._members is None:
+            raise KeyError(member.username)
         return self._members.pop(member.username)
 
+    def load_members(self, members):
+        self._members = {member.username: member for member in members}
+
+    def unload_members(self):
+        self._members = None
+
 
 class ChatroomMember(object):
 
+    __slots__ = MEMBER_FIELDS
+
     def __init__(self, username, display_name=None, nickname=None):
         self.username = username
         self.display_name = display_name
         self.nickname = nickname
 
     @classmethod
-    def from_wx_member(cls, member):
+    def from_wx_member(cls, member, intern=None):
+        username = member['UserName']
         return cls(
-            username=member['UserName'], display_name=member['DisplayName'],
+            username=intern(username) if intern else username, display_name=member['DisplayName'],
             nickname=member['NickName']
         )
 
 
 class ContactSet(object):
 
+    INDEXED_FIELDS = ('nickname', 'remarkname', 'alias')
+
     def __init__(self):
         self._contacts = {}
+        self._indexed = {}
+        self._buckets = defaultdict(dict)
+        self._indexes = {field: defaultdict(set) for field in self.INDEXED_FIELDS}
+        # Sorted (lowercased value, username) pairs for case-insensitive prefix lookup.
+        self._prefix_indexes = {field: [] for field in self.INDEXED_FIELDS}
+        self._strings = {}
+        self._lock = threading.RLock()
 
     def __getitem__(self, key):
         return self._contacts.get(key)
@@ -128,33 +177,108 @@ class ContactSet(object):
 
     @property
     def chatroooms(self):
-        return filter(lambda c: isinstance(c, ChatroomContact), self)
+        return list(self._buckets[ChatroomContact].values())
 
     @property
     def mps(self):
-        return filter(lambda c: isinstance(c, MPContact), self)
+        return list(self._buckets[MPContact].values())
 
     @property
     def friends(self):
-        return filter(lambda c: isinstance(c, FriendContact), self)
+        return list(self._buckets[FriendContact].values())
 
     @property
     def systems(self):
-        return filter(lambda c: isinstance(c, SystemContact), self)
+        return list(self._buckets[SystemContact].values())
 
     def add_or_update(self, contact):
-        self._contacts[contact.username] = contact
+        with self._lock:
+            self._unindex(contact.username)
+            self._contacts[contact.username] = contact
+            self._index(contact)
 
     def remove(self, contact):
-        return self._contacts.pop(contact.username)
+        with self._lock:
+            contact = self._contacts.pop(contact.username)
+            self._unindex(contact.username)
+            return contact
+
+    def intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    @property
+    def interned(self):
+        return len(self._strings)
+
+    def compact_interned(self, chatrooms):
+        """Keeps only the interned usernames of the chatrooms' loaded members."""
+        self._strings = {
+            member.username: member.username
+            for chatroom in chatrooms for member in (chatroom._members or {}).values()
+        }
+
+    def find(self, field, value):
+        return [self._contacts[username] for username in self._indexes[field].get(value, ())]
+
+    def find_by_nickname(self, nickname):
+        return self.find('nickname', nickname)
+
+    def find_by_remarkname(self, remarkname):
+        return self.find('remarkname', remarkname)
+
+    def find_by_alias(self, alias):
+        return self.find('alias', alias)
+
+    def search(self, prefix, fields=INDEXED_FIELDS):
+        prefix = prefix.lower()
+        usernames = set()
+        for field in fields:
+            prefix_index = self._prefix_indexes[field]
+            i = bisect.bisect_left(prefix_index, (prefix,))
+            while i < len(prefix_index) and prefix_index[i][0].startswith(prefix):
+                usernames.add(prefix_index[i][1])
+                i += 1
+        return [self._contacts[username] for username in usernames]
+
+    def _index(self, contact):
+        values = tuple(getattr(contact, field) for field in self.INDEXED_FIELDS)
+        # Remember what was indexed, contacts may be mutated in place before re-adding.
+        self._indexed[contact.username] = (type(contact), values)
+        self._buckets[type(contact)][contact.username] = contact
+        for field, value in zip(self.INDEXED_FIELDS, values):
+            if not value:
+                continue
+            self._indexes[field][value].add(contact.username)
+            bisect.insort(self._prefix_indexes[field], (value.lower(), contact.username))
+
+    def _unindex(self, username):
+        indexed = self._indexed.pop(username, None)
+        if indexed is None:
+            return
+        klass, values = indexed
+        self._buckets[klass].pop(username, None)
+        for field, value in zip(self.INDEXED_FIELDS, values):
+            if not value:
+                continue
+            usernames = self._indexes[field][value]
+            usernames.discard(username)
+            if not usernames:
+                del self._indexes[field][value]
+            prefix_index = self._prefix_indexes[field]
+            key = (value.lower(), username)
+            i = bisect.bisect_left(prefix_index, key)
+            if i < len(prefix_index) and prefix_index[i] == key:
+                del prefix_index[i]
 
 
 class Message(object):
 
-    def __init__(self, content, type, from_username, to_username, media_id=None, message_id=None):
+    def __init__(self, content, type, from_username, to_username, media_id=None, message_id=None,
+                 client_msg_id=None):
         self.content = content
         self.type = type
         self.from_username = from_username
         self.to_username = to_username
         self.media_id = media_id
         self.message_id = message_id
+        self.client_msg_id = client_msg_id
@@ -0,0 +1,299 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import json
+import logging
+import mmap
+import os
+import os.path
+import struct
+import threading
+import zlib
+from array import array
+
+from six.moves import queue
+
+from pywx import config
+from pywx.workers import _spawn_thread
+
+
+logger = logging.getLogger(__name__)
+
+# Log records are ``length, crc32`` followed by the JSON encoded message.
+RECORD_HEADER = struct.Struct('<II')
+# Index records are ``offset, name length`` followed by the conversation username.
+INDEX_HEADER = struct.Struct('<IH')
+
+_FLUSH = object()
+_STOP = object()
+
+
+def _conversation_keys(message):
+    return {message['FromUserName'], message['ToUserName']}
+
+
+def _index_entry(offset, usernames):
+    entries = []
+    for username in usernames:
+        name = username.encode('utf-8')
+        entries.append(INDEX_HEADER.pack(offset, len(name)) + name)
+    return b''.join(entries)
+
+
+class _Postings(object):
+    __slots__ = ('segments', 'offsets')
+
+    def __init__(self):
+        self.segments = array(str('I'))
+        self.offsets = array(str('I'))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, segment, offset):
+        self.segments.append(segment)
+        self.offsets.append(offset)
+
+
+class MessageLog(object):
+    """Append-only log of raw messages, split into numbered segment files.
+
+    Every record is indexed under its ``FromUserName`` and ``ToUserName`` in a
+    per-segment ``.idx`` file, which is loaded into compact in-memory arrays
+    on open, so ``history`` pages through one conversation reading only its
+    records through ``mmap``.  ``append`` only queues; a writer writes queued
+    messages in batches and fsyncs once per batch.  A torn record at the end
+    of the last segment, left by a crash, is truncated on open.
+    """
+
+    def __init__(self, directory, segment_size=config.MESSAGE_LOG_SEGMENT_SIZE,
+                 batch_size=config.MESSAGE_LOG_BATCH_SIZE, spawn=_spawn_thread, queue_class=queue.Queue):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.batch_size = batch_size
+        self.spawn = spawn
+        self.written = 0
+        self.batches = 0
+        self._queue = queue_class(config.MESSAGE_LOG_QUEUE_SIZE)
+        self._index = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._log_fd = None
+        self._idx_fd = None
+        self._segment = 0
+        self._size = 0
+        self._writer = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._open()
+
+    def append(self, message):
+        if self._writer is None:
+            self._writer = self.spawn(self._write_loop)
+        self._queue.put(message)
+
+    def flush(self):
+        """Blocks until every queued message is written and synced."""
+        if self._writer is not None:
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._queue.join()
+            self._writer = None
+        with self._lock:
+            for mm in self._maps.values():
+                mm.close()
+            self._maps.clear()
+        self._log_fd.close()
+        self._idx_fd.close()
+
+    def conversations(self):
+        with self._lock:
+            return list(self._index)
+
+    def count(self, username):
+        with self._lock:
+            postings = self._index.get(username)
+            return len(postings) if postings is not None else 0
+
+    def history(self, username, limit=50, offset=0):
+        """Returns up to ``limit`` messages of a conversation, newest first,
+        skipping the ``offset`` newest ones."""
+        with self._lock:
+            postings = self._index.get(username)
+            if postings is None:
+                return []
+            end = max(len(postings) - offset, 0)
+            start = max(end - limit, 0)
+            positions = list(zip(postings.segments[start:end], postings.offsets[start:end]))
+        return [self._read(segment, position) for segment, position in reversed(positions)]
+
+    def stats(self):
+        return {
+            'segments': self._segment,
+            'conversations': len(self._index),
+            'written': self.written,
+            'batches': self.batches,
+            'queued': self._queue.qsize(),
+        }
+
+    def _path(self, segment, suffix):
+        return os.path.join(self.directory, '%010d.%s' % (segment, suffix))
+
+    def _open(self):
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log'))
+        for segment in segments[:-1]:
+            self._load_index(segment, os.path.getsize(self._path(segment, 'log')))
+        if segments:
+            self._segment = segments[-1]
+            self._recover(self._segment)
+        else:
+            self._segment = 1
+        self._open_segment(self._segment)
+
+    def _open_segment(self, segment):
+        self._log_fd = open(self._path(segment, 'log'), 'ab')
+        self._idx_fd = open(self._path(segment, 'idx'), 'ab')
+        self._size = self._log_fd.tell()
+
+    def _read_index(self, segment):
+        """Yields ``(position, offset, username)`` for a segment's index entries."""
+        path = self._path(segment, 'idx')
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as fd:
+            data = fd.read()
+        position = 0
+        while position + INDEX_HEADER.size <= len(data):
+            offset, length = INDEX_HEADER.unpack_from(data, position)
+            end = position + INDEX_HEADER.size + length
+            if end > len(data):
+                return
+            yield position, offset, data[position + INDEX_HEADER.size:end].decode('utf-8')
+            position = end
+
+    def _load_index(self, segment, log_size):
+        for _, offset, username in self._read_index(segment):
+            if offset < log_size:
+                self._postings(username).append(segment, offset)
+
+    def _recover(self, segment):
+        log_path = self._path(segment, 'log')
+        with open(log_path, 'rb') as fd:
+            data = fd.read()
+
+        # The last indexed record and anything after it may be torn or
+        # unindexed, they are checked again and indexed from the log itself.
+        entries = list(self._read_index(segment))
+        last = max([offset for _, offset, _ in entries if offset < len(data)] or [0])
+        idx_size = 0
+        for position, offset, username in entries:
+            if offset >= last:
+                break
+            self._postings(username).append(segment, offset)
+            idx_size = position + INDEX_HEADER.size + len(username.encode('utf-8'))
+
+        with open(self._path(segment, 'idx'), 'ab') as idx_fd:
+            idx_fd.truncate(idx_size)
+            position = last
+            while position + RECORD_HEADER.size <= len(data):
+                length, crc = RECORD_HEADER.unpack_from(data, position)
+                payload = data[position + RECORD_HEADER.size:position + RECORD_HEADER.size + length]
+                if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+                    break
+                try:
+                    usernames = _conversation_keys(json.loads(payload.decode('utf-8')))
+                except (ValueError, KeyError):
+                    break
+                idx_fd.write(_index_entry(position, usernames))
+                for username in usernames:
+                    self._postings(username).append(segment, position)
+                position += RECORD_HEADER.size + length
+
+        if position < len(data):
+            logger.warning('truncating torn message log %s at %d of %d bytes', log_path, position, len(data))
+            with open(log_path, 'ab') as fd:
+                fd.truncate(position)
+
+    def _postings(self, username):
+        postings = self._index.get(username)
+        if postings is None:
+            postings = self._index[username] = _Postings()
+        return postings
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                messages = [m for m in batch if m is not _FLUSH and m is not _STOP]
+                if messages:
+                    self._write_batch(messages)
+            except Exception:
+                logger.exception('message log write failed')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if any(m is _STOP for m in batch):
+                return
+
+    def _write_batch(self, messages):
+        records, entries, written = [], [], []
+        for message in messages:
+            if self._size >= self.segment_size:
+                self._write(records, entries)
+                records, entries = [], []
+                self._rotate()
+            payload = json.dumps(message, ensure_ascii=False).encode('utf-8')
+            usernames = _conversation_keys(message)
+            records.append(RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+            entries.append(_index_entry(self._size, usernames))
+            written.append((self._segment, self._size, usernames))
+            self._size += len(records[-1])
+        self._write(records, entries)
+
+        # Records only become visible to readers once they are on disk.
+        with self._lock:
+            for segment, offset, usernames in written:
+                for username in usernames:
+                    self._postings(username).append(segment, offset)
+        self.written += len(messages)
+        self.batches += 1
+
+    def _write(self, records, entries):
+        self._log_fd.write(b''.join(records))
+        self._log_fd.flush()
+        os.fsync(self._log_fd.fileno())
+        self._idx_fd.write(b''.join(entries))
+        self._idx_fd.flush()
+        os.fsync(self._idx_fd.fileno())
+
+    def _rotate(self):
+        self._log_fd.close()
+        self._idx_fd.close()
+        self._segment += 1
+        self._open_segment(self._segment)
+
+    def _read(self, segment, offset):
+        mm = self._map(segment, offset + RECORD_HEADER.size)
+        length, _ = RECORD_HEADER.unpack_from(mm, offset)
+        start = offset + RECORD_HEADER.size
+        mm = self._map(segment, start + length)
+        return json.loads(mm[start:start + length].decode('utf-8'))
+
+    def _map(self, segment, needed):
+        with self._lock:
+            mm = self._maps.get(segment)
+            if mm is None or len(mm) < needed:
+                # The active segment grows, it is mapped again past its old end.
+                with open(self._path(segment, 'log'), 'rb') as fd:
+                    mm = self._maps[segment] = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            return mm
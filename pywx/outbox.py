@@ -0,0 +1,192 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import threading
+from collections import OrderedDict
+from timeit import default_timer
+
+from pywx import config
+from pywx.exceptions import OutboxStopped, SendError, SendTimeout, TransportError
+from pywx.utils import backoff_delay, gen_client_msg_id
+from pywx.workers import PartitionedWorkerPool
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst, sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._updated = default_timer()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = default_timer()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self.sleep(wait)
+
+
+class SendTicket(object):
+    """Handle for a queued message, ``result()`` waits for the send response."""
+
+    def __init__(self, message, event):
+        self.message = message
+        self.attempts = 0
+        self.response = None
+        self.error = None
+        self.accepted_at = default_timer()
+        self.sent_at = None
+        self._event = event
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def client_msg_id(self):
+        return self.message.client_msg_id
+
+    def done(self):
+        return self._event.is_set()
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def result(self, timeout=None):
+        if not self.wait(timeout):
+            raise SendTimeout('send of %s still pending' % self.client_msg_id)
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def _resolve(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.sent_at = default_timer()
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception('send callback failed')
+
+
+class Outbox(object):
+    """Paced, retrying sender keeping per-recipient FIFO order.
+
+    Messages to one ``to_username`` share a worker, so they go out in the
+    order they were queued.  Sends are paced by a token bucket, failures in
+    transport or with a retryable ``BaseResponse.Ret`` are retried with
+    backoff, and a ``ClientMsgId`` seen recently returns its earlier ticket.
+    """
+
+    def __init__(self, client, rate=config.SEND_RATE, burst=config.SEND_BURST, retries=config.SEND_RETRIES,
+                 workers=config.SEND_WORKERS):
+        self.client = client
+        self.retries = retries
+        self.bucket = TokenBucket(rate, burst, sleep=client.sleep)
+        self.pool = PartitionedWorkerPool(
+            self._deliver, size=workers, maxsize=config.SEND_QUEUE_SIZE,
+            key=lambda ticket: ticket.message.to_username, spawn=client._spawn, queue_class=client.queue_class
+        )
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.duplicates = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def submit(self, message):
+        if message.client_msg_id is None:
+            message.client_msg_id = gen_client_msg_id()
+        with self._lock:
+            ticket = self._tickets.get(message.client_msg_id)
+            if ticket is not None:
+                self.duplicates += 1
+                return ticket
+            ticket = self._tickets[message.client_msg_id] = SendTicket(message, self.client.event_class())
+            while len(self._tickets) > config.SEND_DEDUP_WINDOW:
+                self._tickets.popitem(last=False)
+            self.accepted += 1
+        if not self.pool.submit(ticket):
+            with self._lock:
+                self._tickets.pop(message.client_msg_id, None)
+                self.failed += 1
+            ticket._resolve(error=OutboxStopped('outbox is stopped'))
+        return ticket
+
+    def start(self):
+        self.pool.start()
+
+    def stop(self):
+        self.pool.stop()
+
+    def stats(self):
+        return {
+            'accepted': self.accepted,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'duplicates': self.duplicates,
+            'queued': self.pool.stats()['queued'],
+            'latency_avg_ms': self._latency_total / self.sent * 1000 if self.sent else 0.0,
+            'latency_max_ms': self._latency_max * 1000,
+        }
+
+    def _deliver(self, ticket):
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self.retried += 1
+                self.client.sleep(backoff_delay(attempt, config.SEND_BACKOFF_BASE))
+            self.bucket.acquire()
+            ticket.attempts += 1
+            try:
+                response = self.client._send_message(ticket.message)
+                ret = response.json()['BaseResponse']['Ret']
+            except (TransportError, ValueError, KeyError) as e:
+                error = e
+                continue
+            if ret == 0:
+                self._record_sent(ticket, response)
+                return
+            error = SendError(ret)
+            if ret not in config.SEND_RETRY_RETS:
+                break
+        logger.warning('send %s to %s failed: %r', ticket.client_msg_id, ticket.message.to_username, error)
+        with self._lock:
+            self.failed += 1
+        ticket._resolve(error=error)
+
+    def _record_sent(self, ticket, response):
+        ticket._resolve(response=response)
+        latency = ticket.sent_at - ticket.accepted_at
+        with self._lock:
+            self.sent += 1
+            self._latency_total += latency
+            if latency > self._latency_max:
+                self._latency_max = latency
@@ -0,0 +1,114 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import os.path
+from collections import OrderedDict
+
+import gevent
+from requests.adapters import HTTPAdapter
+
+from pywx import config
+from pywx.async_client import AsyncWXClient
+from pywx.session import SessionStore
+from pywx.transport import RequestsTransport
+
+
+class WXClientPool(object):
+    """Hosts many accounts in one process.
+
+    Every account gets its own cookie jar but all of them share the
+    :class:`HTTPAdapter` of API calls and the one of long-polls, i.e. two
+    keep-alive pools per WeChat host, and their sync loops are greenlets on
+    the same gevent hub.  Every account keeps a long-poll open, so the
+    long-poll pool is doubled whenever the accounts outgrow it.  With
+    ``session_dir`` each account resumes from ``<session_dir>/<name>.json``.
+    """
+
+    def __init__(self, client_class=AsyncWXClient, session_dir=None,
+                 pool_connections=config.POOL_CONNECTIONS, pool_maxsize=config.POOL_MAXSIZE,
+                 longpoll_pool_maxsize=config.POOL_MAXSIZE):
+        self.client_class = client_class
+        self.session_dir = session_dir
+        self.pool_connections = pool_connections
+        self.longpoll_pool_maxsize = longpoll_pool_maxsize
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.longpoll_adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=longpoll_pool_maxsize)
+        self.clients = OrderedDict()
+        self._logins = {}
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    def __getitem__(self, name):
+        return self.clients[name]
+
+    def add(self, name, **kwargs):
+        if 'transport' not in kwargs:
+            kwargs['transport'] = RequestsTransport(adapter=self.adapter, longpoll_adapter=self.longpoll_adapter)
+        if 'session_store' not in kwargs and self.session_dir is not None:
+            kwargs['session_store'] = SessionStore(os.path.join(self.session_dir, '%s.json' % name))
+        client = self.client_class(**kwargs)
+        self.clients[name] = client
+        if len(self.clients) > self.longpoll_pool_maxsize:
+            self._grow_longpoll_pool(max(2 * self.longpoll_pool_maxsize, len(self.clients)))
+        return client
+
+    def _grow_longpoll_pool(self, maxsize):
+        # Past maxsize urllib3 drops returned connections and the next long-polls handshake again.
+        poolmanager = self.longpoll_adapter.poolmanager
+        self.longpoll_adapter.init_poolmanager(self.pool_connections, maxsize)
+        self.longpoll_pool_maxsize = maxsize
+        poolmanager.clear()
+
+    def remove(self, name):
+        client = self.clients.pop(name)
+        login = self._logins.pop(name, None)
+        if login is not None:
+            login.kill(block=False)
+        client.stop()
+        return client
+
+    def start(self):
+        for name, client in self.clients.items():
+            login = self._logins.get(name)
+            if client.online or (login is not None and not login.ready()):
+                continue
+            self._logins[name] = client.login()
+
+    def stop(self):
+        for login in self._logins.values():
+            login.kill(block=False)
+        self._logins.clear()
+        for client in self.clients.values():
+            client.stop()
+
+    def join(self, timeout=None):
+        gevent.joinall([login for login in self._logins.values()], timeout=timeout)
+
+    def health(self):
+        accounts = OrderedDict()
+        for name, client in self.clients.items():
+            login = self._logins.get(name)
+            if login is None:
+                login_state = 'idle'
+            elif not login.ready():
+                login_state = 'pending'
+            elif login.successful():
+                login_state = 'done'
+            else:
+                login_state = 'failed: %r' % login.exception
+            accounts[name] = {
+                'online': client.online,
+                'syncing': client.syncing,
+                'uin': client.uin,
+                'login': login_state,
+            }
+        return {
+            'total': len(accounts),
+            'online': sum(1 for account in accounts.values() if account['online']),
+            'syncing': sum(1 for account in accounts.values() if account['syncing']),
+            'accounts': accounts,
+        }
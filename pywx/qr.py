@@ -0,0 +1,64 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import sys
+
+import six
+
+
+# Characters for the (top, bottom) module pairs of one terminal row, dark modules printed as blanks.
+_HALF_BLOCKS = {
+    (False, False): '█',
+    (False, True): '▀',
+    (True, False): '▄',
+    (True, True): ' ',
+}
+
+
+def show_image(png, login_url):
+    """Opens the QR code in an image viewer, needs Pillow and a display."""
+    from PIL import Image
+
+    Image.open(io.BytesIO(png)).show()
+
+
+def print_terminal(png, login_url, stream=None):
+    """Prints the QR code as text, for servers without a display.
+
+    The code is drawn from ``login_url`` rather than decoded from the image,
+    which needs the ``qrcode`` package.
+    """
+    try:
+        import qrcode
+    except ImportError:
+        raise ImportError('printing the login QR code needs the qrcode package: pip install qrcode')
+
+    code = qrcode.QRCode(border=2)
+    code.add_data(login_url)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    if len(matrix) % 2:
+        matrix.append([False] * len(matrix[0]))
+
+    stream = stream or sys.stdout
+    lines = [
+        ''.join(_HALF_BLOCKS[pair] for pair in zip(top, bottom))
+        for top, bottom in zip(matrix[::2], matrix[1::2])
+    ]
+    text = '\n'.join(lines + [login_url, ''])
+    # Python 2 leaves piped or redirected stdout without an encoding and writes unicode to it as ASCII.
+    if six.PY2 and isinstance(stream, file) and not stream.encoding:  # noqa: F821
+        text = text.encode('utf-8')
+    stream.write(text)
+    stream.flush()
+
+
+def save_png(path):
+    """Returns a callback writing the QR code image to ``path``."""
+
+    def callback(png, login_url):
+        with io.open(path, 'wb') as fd:
+            fd.write(png)
+
+    return callback
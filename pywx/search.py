@@ -0,0 +1,144 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import re
+import sqlite3
+import threading
+from collections import namedtuple
+from timeit import default_timer
+
+from pywx import config
+
+
+RE_CJK_RUN_PATTERN = re.compile(
+    '[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+'
+)
+RE_WORD_PATTERN = re.compile(r'[^\W_]+', re.UNICODE)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    msg_id TEXT NOT NULL UNIQUE,
+    conversation TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation, created);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, created);
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    message INTEGER NOT NULL,
+    PRIMARY KEY (token, message)
+) WITHOUT ROWID;
+'''
+
+SearchResult = namedtuple('SearchResult', ('msg_id', 'conversation', 'sender', 'created', 'content'))
+
+
+def tokenize(text):
+    """Splits text into lowercase words and CJK character unigrams and bigrams."""
+    text = text.lower()
+    tokens = set()
+    for run in RE_CJK_RUN_PATTERN.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.update(RE_WORD_PATTERN.findall(RE_CJK_RUN_PATTERN.sub(' ', text)))
+    return tokens
+
+
+def _like_pattern(term):
+    return '%%%s%%' % re.sub(r'([\\%_])', r'\\\1', term)
+
+
+class MessageIndex(object):
+    """Inverted index of text messages stored in SQLite.
+
+    Messages are indexed as they arrive, so opening an existing index costs
+    nothing.  Query terms must all occur in a message; postings narrow the
+    candidates and a substring match confirms them.  Inserts are committed
+    every ``SEARCH_COMMIT_BATCH`` messages or ``SEARCH_COMMIT_INTERVAL``
+    seconds, and on ``commit``.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._committed_at = default_timer()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def add(self, msg_id, conversation, sender, created, content):
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO messages (msg_id, conversation, sender, created, content) '
+                'VALUES (?, ?, ?, ?, ?)', (msg_id, conversation, sender, created, content)
+            )
+            if cursor.rowcount:
+                message = cursor.lastrowid
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO postings (token, message) VALUES (?, ?)',
+                    ((token, message) for token in tokenize(content))
+                )
+                self._pending += 1
+            if (self._pending >= config.SEARCH_COMMIT_BATCH or
+                    default_timer() - self._committed_at >= config.SEARCH_COMMIT_INTERVAL):
+                self._commit()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+    def search(self, query, chatroom=None, sender=None, since=None, until=None, limit=20):
+        """Returns the ``limit`` most recent messages containing every term
+        of ``query``, optionally within one conversation, from one sender or
+        in a ``CreateTime`` range."""
+        terms = query.lower().split()
+        if not terms:
+            return []
+        tokens = set()
+        for term in terms:
+            tokens.update(tokenize(term))
+
+        clauses = []
+        params = []
+        if tokens:
+            clauses.append('id IN (%s)' % ' INTERSECT '.join(
+                'SELECT message FROM postings WHERE token = ?' for _ in tokens
+            ))
+            params.extend(tokens)
+        for term in terms:
+            clauses.append("content LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(term))
+        for column, value in (('conversation', chatroom), ('sender', sender)):
+            if value is not None:
+                clauses.append('%s = ?' % column)
+                params.append(getattr(value, 'username', value))
+        if since is not None:
+            clauses.append('created >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('created < ?')
+            params.append(until)
+        params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT msg_id, conversation, sender, created, content FROM messages WHERE %s '
+                'ORDER BY created DESC, id DESC LIMIT ?' % ' AND '.join(clauses), params
+            ).fetchall()
+        return [SearchResult(*row) for row in rows]
+
+    def _commit(self):
+        self._db.commit()
+        self._pending = 0
+        self._committed_at = default_timer()
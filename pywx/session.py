@@ -0,0 +1,35 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import os.path
+import tempfile
+
+
+class SessionStore(object):
+    """Saves a logged in client's session state to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with io.open(self.path, 'r', encoding='utf-8') as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, state):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.session-')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(json.dumps(state).encode('utf-8'))
+        os.rename(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
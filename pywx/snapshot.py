@@ -0,0 +1,134 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import sqlite3
+import threading
+
+from pywx.models import (
+    CONTACT_FIELDS, MEMBER_FIELDS, ChatroomContact, ChatroomMember, FriendContact, MPContact, SystemContact,
+)
+
+
+CONTACT_KINDS = {
+    'chatroom': ChatroomContact,
+    'mp': MPContact,
+    'friend': FriendContact,
+    'system': SystemContact,
+}
+KIND_NAMES = {klass: kind for kind, klass in CONTACT_KINDS.items()}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contacts (
+    uin TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    sex INTEGER,
+    nickname TEXT,
+    alias TEXT,
+    remarkname TEXT,
+    encry_chatroom_id TEXT,
+    province TEXT,
+    city TEXT,
+    PRIMARY KEY (uin, username)
+);
+CREATE TABLE IF NOT EXISTS members (
+    uin TEXT NOT NULL,
+    chatroom TEXT NOT NULL,
+    username TEXT NOT NULL,
+    display_name TEXT,
+    nickname TEXT,
+    PRIMARY KEY (uin, chatroom, username)
+);
+'''
+
+
+class ContactSnapshot(object):
+    """SQLite snapshot of an account's contacts, keyed by uin.
+
+    ``save`` only writes rows that differ from what was last loaded or saved.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._contact_rows = {}
+        self._member_rows = {}
+
+    def load(self, client, uin):
+        with self._lock:
+            contact_rows, member_rows = self._rows('%s' % uin)
+            contacts = {}
+            for username, row in contact_rows.items():
+                klass = CONTACT_KINDS[row[0]]
+                contacts[username] = klass(client=client, **dict(zip(CONTACT_FIELDS, row[1:])))
+            for (chatroom_username, username), row in member_rows.items():
+                chatroom = contacts.get(chatroom_username)
+                if isinstance(chatroom, ChatroomContact):
+                    chatroom.add_member(ChatroomMember(client.contacts.intern(username), *row))
+        return list(contacts.values())
+
+    def save(self, uin, contacts):
+        uin = '%s' % uin
+        contact_rows = {}
+        member_rows = {}
+        unloaded_chatrooms = set()
+        for contact in contacts:
+            kind = KIND_NAMES.get(type(contact))
+            if kind is None:
+                continue
+            contact_rows[contact.username] = (kind,) + tuple(getattr(contact, f) for f in CONTACT_FIELDS)
+            if kind != 'chatroom':
+                continue
+            if not contact.members_loaded:
+                unloaded_chatrooms.add(contact.username)
+                continue
+            for member in contact.members:
+                member_rows[(contact.username, member.username)] = (member.display_name, member.nickname)
+
+        with self._lock:
+            old_contact_rows, old_member_rows = self._rows(uin)
+            # Keep the stored members of chatrooms whose members are not loaded right now.
+            member_rows.update(
+                (key, row) for key, row in old_member_rows.items() if key[0] in unloaded_chatrooms
+            )
+            with self._db:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO contacts (uin, kind, %s) VALUES (?, ?, %s)' % (
+                        ', '.join(CONTACT_FIELDS), ', '.join('?' * len(CONTACT_FIELDS))
+                    ),
+                    ((uin,) + row for username, row in contact_rows.items()
+                     if old_contact_rows.get(username) != row)
+                )
+                self._db.executemany(
+                    'DELETE FROM contacts WHERE uin = ? AND username = ?',
+                    ((uin, username) for username in old_contact_rows if username not in contact_rows)
+                )
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO members (uin, chatroom, %s) VALUES (?, ?, %s)' % (
+                        ', '.join(MEMBER_FIELDS), ', '.join('?' * len(MEMBER_FIELDS))
+                    ),
+                    ((uin,) + key + row for key, row in member_rows.items()
+                     if old_member_rows.get(key) != row)
+                )
+                self._db.executemany(
+                    'DELETE FROM members WHERE uin = ? AND chatroom = ? AND username = ?',
+                    ((uin,) + key for key in old_member_rows if key not in member_rows)
+                )
+            self._contact_rows[uin] = contact_rows
+            self._member_rows[uin] = member_rows
+
+    def _rows(self, uin):
+        if uin not in self._contact_rows:
+            cursor = self._db.execute(
+                'SELECT kind, %s FROM contacts WHERE uin = ?' % ', '.join(CONTACT_FIELDS), (uin,)
+            )
+            self._contact_rows[uin] = {row[1]: tuple(row) for row in cursor}
+            cursor = self._db.execute(
+                'SELECT chatroom, %s FROM members WHERE uin = ?' % ', '.join(MEMBER_FIELDS), (uin,)
+            )
+            self._member_rows[uin] = {row[:2]: row[2:] for row in cursor}
+        return self._contact_rows[uin], self._member_rows[uin]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,90 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import time
+from timeit import default_timer
+
+from pywx import config
+from pywx.exceptions import TransportError, TransportTimeout
+from pywx.utils import backoff_delay
+
+
+logger = logging.getLogger(__name__)
+
+
+class SyncScheduler(object):
+    """Runs a client's synccheck/webwxsync loop.
+
+    Failed polls back off exponentially with jitter, polls that come back
+    empty sooner than ``min_interval`` are spaced out, and a logout retcode
+    ends the loop through ``client._on_logout``.
+    """
+
+    def __init__(self, client, longpoll_timeout=config.SYNC_CHECK_TIMEOUT, min_interval=config.SYNC_MIN_INTERVAL,
+                 backoff_base=config.SYNC_BACKOFF_BASE, backoff_max=config.SYNC_BACKOFF_MAX, sleep=time.sleep):
+        self.client = client
+        self.longpoll_timeout = longpoll_timeout
+        self.min_interval = min_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+
+        self.polls = 0
+        self.empty_polls = 0
+        self.syncs = 0
+        self.errors = 0
+        self.failures = 0
+
+    def stats(self):
+        return {
+            'polls': self.polls,
+            'empty_polls': self.empty_polls,
+            'syncs': self.syncs,
+            'errors': self.errors,
+            'consecutive_failures': self.failures,
+        }
+
+    def run(self):
+        while self.client.online:
+            self.poll()
+
+    def poll(self):
+        started = default_timer()
+        try:
+            retcode, selector = self.client._sync_check(timeout=self.longpoll_timeout)
+        except TransportTimeout:
+            retcode, selector = 0, 0
+        except TransportError as e:
+            return self._fail('synccheck failed: %s', e)
+        self.polls += 1
+
+        if retcode is None:
+            return self._fail('synccheck response not understood')
+        if retcode in config.SYNC_LOGOUT_RETCODES:
+            return self.client._on_logout(retcode)
+        if retcode != 0:
+            return self._fail('synccheck retcode %s', retcode)
+
+        if selector == 0:
+            self.empty_polls += 1
+            self.failures = 0
+            elapsed = default_timer() - started
+            if elapsed < self.min_interval:
+                self.sleep(self.min_interval - elapsed)
+            return
+
+        try:
+            self.client._sync_message()
+        except Exception as e:
+            logger.exception('webwxsync failed')
+            return self._fail('webwxsync failed: %s', e)
+        self.syncs += 1
+        self.failures = 0
+
+    def _fail(self, message, *args):
+        self.errors += 1
+        self.failures += 1
+        delay = backoff_delay(self.failures, self.backoff_base, self.backoff_max)
+        logger.warning(message + ', retrying in %.1fs', *(args + (delay,)))
+        self.sleep(delay)
@@ -0,0 +1,330 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import random
+import time
+from collections import OrderedDict, deque
+from timeit import default_timer
+
+from six.moves.urllib.parse import urlparse
+
+from pywx import config
+from pywx.transport import Transport
+
+
+# 1x1 PNG served as the login QR code.
+QRCODE_PNG = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x01\x00\x00\x00\x007n\xf9$'
+    b'\x00\x00\x00\nIDATx\x9cc`\x00\x00\x00\x02\x00\x01H\xaf\xa4q\x00\x00\x00\x00IEND\xaeB`\x82'
+)
+
+DEFAULT_MESSAGE_MIX = {
+    config.MessageType.TEXT: 75,
+    config.MessageType.IMAGE: 8,
+    config.MessageType.EMOTICON: 6,
+    config.MessageType.APP: 5,
+    config.MessageType.VOICE: 3,
+    config.MessageType.STATUSNOTIFY: 2,
+    config.MessageType.VIDEO: 1,
+}
+
+
+class FakeResponse(object):
+
+    def __init__(self, content, status_code=200):
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        self.content = content
+        self.status_code = status_code
+        self.encoding = None
+
+    def json(self):
+        return json.loads(self.content.decode(self.encoding or 'utf-8'))
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeWXServer(object):
+    """In-process stand-in for the web WeChat endpoints in :mod:`pywx.config`.
+
+    It serves ``contacts`` friends and ``chatrooms`` groups of ``members``
+    members each.  With ``message_rate`` unset every ``webwxsync`` returns
+    ``batch_size`` new messages, otherwise messages arrive at that many per
+    second and ``synccheck`` long-polls up to ``longpoll`` seconds for them,
+    waiting with ``sleep`` (pass ``gevent.sleep`` for unpatched greenlets).
+    """
+
+    def __init__(self, contacts=100, chatrooms=10, members=50, message_rate=None,
+                 batch_size=10, message_mix=None, longpoll=1.0, seed=None, sleep=time.sleep):
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.message_rate = message_rate
+        self.batch_size = batch_size
+        self.longpoll = longpoll
+        self.message_types, self.message_weights = zip(*sorted((message_mix or DEFAULT_MESSAGE_MIX).items()))
+
+        self.uuid = 'fakeuuid=='
+        self.uin = '%d' % self.random.randint(10 ** 9, 10 ** 10)
+        self.sid = 'fakesid'
+        self.skey = '@crypt_fake_skey'
+        self.pass_ticket = 'fakepassticket'
+        self.user = self._gen_contact('@%032x' % self.random.getrandbits(128), sex=1)
+        self.user['Uin'] = int(self.uin)
+
+        self.friends = [self._gen_contact('@%032x' % self.random.getrandbits(128), sex=1 + i % 2)
+                        for i in range(contacts)]
+        self.chatrooms = []
+        for _ in range(chatrooms):
+            chatroom = self._gen_contact('@@%064x' % self.random.getrandbits(256), sex=0)
+            chatroom['EncryChatRoomId'] = '@%032x' % self.random.getrandbits(128)
+            chatroom['MemberList'] = [
+                {'UserName': friend['UserName'], 'NickName': friend['NickName'], 'DisplayName': ''}
+                for friend in self.random.sample(self.friends, min(members, len(self.friends)))
+            ]
+            self.chatrooms.append(chatroom)
+        self.senders = self.friends + self.chatrooms
+        self.contacts = {c['UserName']: c for c in self.senders}
+
+        self.sync_seq = 1
+        self.message_seq = 10 ** 18
+        self.pending = deque()
+        self.created = {}
+        self.sent_messages = []
+        # Uploads by ClientMediaId, and the MD5 of each completed one by MediaId.
+        self.uploads = {}
+        self.media = {}
+        self.upload_failures = 0
+        # Media payloads are picked from a few blobs, like stickers repeating across chats.
+        self.media_blobs = [bytes(bytearray(self.random.getrandbits(8) for _ in range(4096))) for _ in range(3)]
+        self.media_downloads = 0
+        self.mod_contacts = OrderedDict()
+        self.del_contacts = OrderedDict()
+        self._last_generated = default_timer()
+
+        self.routes = {
+            'jslogin': self.jslogin,
+            'qrcode': self.qrcode,
+            'login': self.login_check,
+            'webwxnewloginpage': self.login_info,
+            'webwxinit': self.webwxinit,
+            'webwxstatusnotify': self.webwxstatusnotify,
+            'webwxgetcontact': self.webwxgetcontact,
+            'webwxbatchgetcontact': self.webwxbatchgetcontact,
+            'synccheck': self.synccheck,
+            'webwxsync': self.webwxsync,
+            'webwxsendmsg': self.webwxsendmsg,
+            'webwxsendmsgimg': self.webwxsendmsg,
+            'webwxsendappmsg': self.webwxsendmsg,
+            'webwxuploadmedia': self.webwxuploadmedia,
+            'webwxgetmsgimg': self.webwxgetmedia,
+            'webwxgetvoice': self.webwxgetmedia,
+            'webwxgetvideo': self.webwxgetmedia,
+            'webwxlogout': self.webwxlogout,
+        }
+
+    @property
+    def sync_key(self):
+        return {'Count': 1, 'List': [{'Key': 1, 'Val': self.sync_seq}]}
+
+    def handle(self, method, url, params=None, data=None, json=None, files=None, **kwargs):
+        path = urlparse(url).path.strip('/').split('/')
+        endpoint = path[0] if path[0] == 'qrcode' else path[-1]
+        handler = self.routes.get(endpoint)
+        if handler is None:
+            return FakeResponse('', status_code=404)
+        if files:
+            data = dict(data or {}, **files)
+        return handler(params or {}, json or data or {})
+
+    def update_contact(self, username, **fields):
+        """Changes a contact, it is sent in the next ``ModContactList``."""
+        contact = self.contacts[username]
+        contact.update(fields)
+        if 'MemberList' in fields:
+            contact['MemberCount'] = len(fields['MemberList'])
+        self.mod_contacts[username] = contact
+
+    def remove_contact(self, username):
+        """Drops a contact, it is sent in the next ``DelContactList``."""
+        contact = self.contacts.pop(username)
+        for contacts in (self.friends, self.chatrooms, self.senders):
+            if contact in contacts:
+                contacts.remove(contact)
+        self.mod_contacts.pop(username, None)
+        self.del_contacts[username] = {'UserName': username, 'ContactFlag': 0}
+
+    def _gen_contact(self, username, sex):
+        return {
+            'UserName': username, 'NickName': 'nick%s' % username[-6:], 'RemarkName': '',
+            'Alias': '', 'Sex': sex, 'EncryChatRoomId': '', 'Province': '', 'City': '',
+            'MemberList': [], 'MemberCount': 0,
+        }
+
+    def _base_response(self, **kwargs):
+        kwargs['BaseResponse'] = {'Ret': 0, 'ErrMsg': ''}
+        return FakeResponse(json.dumps(kwargs))
+
+    def _gen_message(self):
+        self.message_seq += 1
+        message_type = self._weighted_choice()
+        from_contact = self.random.choice(self.senders)
+        content = 'message %d <span class="emoji emoji1f604"></span>' % self.message_seq
+        if from_contact['MemberList']:
+            member = self.random.choice(from_contact['MemberList'])
+            content = '%s:<br/>%s' % (member['UserName'], content)
+        message = {
+            'MsgId': '%d' % self.message_seq,
+            'MsgType': int(message_type),
+            'FromUserName': from_contact['UserName'],
+            'ToUserName': self.user['UserName'],
+            'Content': content,
+            'CreateTime': int(time.time()),
+            'StatusNotifyCode': 0,
+            'StatusNotifyUserName': '',
+        }
+        if message_type == config.MessageType.STATUSNOTIFY:
+            message['Content'] = ''
+            message['StatusNotifyCode'] = config.StatusNotifyCode.SYNC_CONV.value
+            message['StatusNotifyUserName'] = ','.join(c['UserName'] for c in self.chatrooms[:20])
+        self.created[message['MsgId']] = default_timer()
+        return message
+
+    def _weighted_choice(self):
+        point = self.random.uniform(0, sum(self.message_weights))
+        for message_type, weight in zip(self.message_types, self.message_weights):
+            point -= weight
+            if point <= 0:
+                return message_type
+        return self.message_types[-1]
+
+    def _generate_due(self):
+        if self.message_rate is None:
+            return
+        now = default_timer()
+        due = int((now - self._last_generated) * self.message_rate)
+        if due:
+            self._last_generated += float(due) / self.message_rate
+            self.pending.extend(self._gen_message() for _ in range(due))
+
+    def jslogin(self, params, data):
+        return FakeResponse('window.QRLogin.code = 200; window.QRLogin.uuid = "%s";' % self.uuid)
+
+    def qrcode(self, params, data):
+        return FakeResponse(QRCODE_PNG)
+
+    def login_check(self, params, data):
+        redirect_url = '%s/%s/webwxnewloginpage?ticket=fake&uuid=%s&lang=zh_CN&scan=%d' % (
+            config.WX_BASE_URL, config.WX_CGI_PATH, self.uuid, int(time.time())
+        )
+        return FakeResponse('window.code=200;\nwindow.redirect_uri="%s";' % redirect_url)
+
+    def login_info(self, params, data):
+        return FakeResponse(
+            '<error><ret>0</ret><message></message><skey>%s</skey><wxsid>%s</wxsid>'
+            '<wxuin>%s</wxuin><pass_ticket>%s</pass_ticket><isgrayscale>1</isgrayscale></error>' % (
+                self.skey, self.sid, self.uin, self.pass_ticket
+            )
+        )
+
+    def webwxinit(self, params, data):
+        return self._base_response(
+            User=self.user, SyncKey=self.sync_key, ContactList=self.chatrooms[:10],
+            Count=min(len(self.chatrooms), 10),
+        )
+
+    def webwxstatusnotify(self, params, data):
+        return self._base_response(MsgID='%d' % self.message_seq)
+
+    def webwxgetcontact(self, params, data):
+        # The own account is listed too so that messages sent to it resolve.
+        member_list = [self.user] + self.friends + [dict(c, MemberList=[]) for c in self.chatrooms]
+        return self._base_response(MemberCount=len(member_list), MemberList=member_list, Seq=0)
+
+    def webwxbatchgetcontact(self, params, data):
+        contact_list = [self.contacts[item['UserName']] for item in data.get('List', [])
+                        if item['UserName'] in self.contacts]
+        return self._base_response(Count=len(contact_list), ContactList=contact_list)
+
+    def synccheck(self, params, data):
+        if params.get('sid') != self.sid or params.get('skey') != self.skey:
+            return FakeResponse('window.synccheck={retcode:"1101",selector:"0"}')
+        self._generate_due()
+        if self.message_rate is not None and not self.pending:
+            self.sleep(min(self.longpoll, 1.0 / self.message_rate))
+            self._generate_due()
+        selector = 2 if self.pending or self.mod_contacts or self.del_contacts or self.message_rate is None else 0
+        return FakeResponse('window.synccheck={retcode:"0",selector:"%d"}' % selector)
+
+    def webwxsync(self, params, data):
+        if self.message_rate is None:
+            messages = [self._gen_message() for _ in range(self.batch_size)]
+        else:
+            self._generate_due()
+            messages = list(self.pending)
+            self.pending.clear()
+        mod_contacts = list(self.mod_contacts.values())
+        del_contacts = list(self.del_contacts.values())
+        self.mod_contacts.clear()
+        self.del_contacts.clear()
+        self.sync_seq += 1
+        return self._base_response(
+            AddMsgCount=len(messages), AddMsgList=messages,
+            ModContactCount=len(mod_contacts), ModContactList=mod_contacts,
+            DelContactCount=len(del_contacts), DelContactList=del_contacts,
+            ModChatRoomMemberCount=0, ModChatRoomMemberList=[],
+            SyncKey=self.sync_key, SyncCheckKey=self.sync_key,
+        )
+
+    def webwxsendmsg(self, params, data):
+        message = data['Msg']
+        self.sent_messages.append(message)
+        return self._base_response(MsgID='%d' % len(self.sent_messages), LocalID=message['LocalID'])
+
+    def webwxuploadmedia(self, params, data):
+        if self.upload_failures:
+            self.upload_failures -= 1
+            return FakeResponse(json.dumps({'BaseResponse': {'Ret': 1, 'ErrMsg': ''}, 'MediaId': ''}))
+        request = json.loads(data['uploadmediarequest'])
+        chunks = self.uploads.setdefault(request['ClientMediaId'], {})
+        chunks[int(data.get('chunk', 0))] = data['filename'][1]
+        if len(chunks) < int(data.get('chunks', 1)):
+            return self._base_response(MediaId='', StartPos=0)
+        content = b''.join(chunks[i] for i in range(len(chunks)))
+        media_id = '@crypt_%s' % hashlib.md5(content).hexdigest()
+        self.media[media_id] = request['FileMd5']
+        return self._base_response(MediaId=media_id, StartPos=len(content))
+
+    def webwxgetmedia(self, params, data):
+        self.media_downloads += 1
+        msg_id = params.get('MsgID') or params.get('msgid')
+        return FakeResponse(self.media_blobs[int(msg_id) % len(self.media_blobs)])
+
+    def webwxlogout(self, params, data):
+        return FakeResponse('')
+
+
+class FakeTransport(Transport):
+
+    def __init__(self, server):
+        self.server = server
+        self._cookies = {'mm_lang': 'zh_CN'}
+
+    @property
+    def cookies(self):
+        return self._cookies
+
+    def request(self, method, url, **kwargs):
+        return self.server.handle(method, url, **kwargs)
+
+    def dump_cookies(self):
+        return [{'name': name, 'value': value} for name, value in self._cookies.items()]
+
+    def load_cookies(self, cookies):
+        self._cookies.update((cookie['name'], cookie['value']) for cookie in cookies)
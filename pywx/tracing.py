@@ -0,0 +1,121 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import functools
+import importlib
+import io
+import os.path
+import sys
+from collections import Counter
+
+import six
+
+from pywx import config
+
+
+_thread_module = 'thread' if six.PY2 else '_thread'
+
+
+def _original(module, name):
+    # The profiler samples OS threads, even when gevent has patched them into
+    # greenlets.  Nothing is patched unless gevent.monkey was imported.
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
+
+
+def real_get_ident():
+    return _original(_thread_module, 'get_ident')()
+
+
+class Tracer(object):
+    """Span callbacks, subclass and pass to ``WXClient.set_tracer``.
+
+    ``start_span`` returns a token handed back to ``end_span`` together with
+    the exception that ended the span, if any.
+    """
+
+    def start_span(self, name, attributes):
+        pass
+
+    def end_span(self, token, error=None):
+        pass
+
+
+def traced(name, attributes=None):
+    """Wraps a client method in a span when the client has a tracer.
+
+    ``attributes(self, *args, **kwargs)`` returns the span attributes.
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            tracer = self.tracer
+            if tracer is None:
+                return method(self, *args, **kwargs)
+            token = tracer.start_span(name, attributes(self, *args, **kwargs) if attributes else {})
+            try:
+                result = method(self, *args, **kwargs)
+            except BaseException as e:
+                tracer.end_span(token, e)
+                raise
+            tracer.end_span(token)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class SamplingProfiler(object):
+    """Samples the stack of one thread from a separate OS thread.
+
+    ``thread_id`` is an OS thread id, or a callable returning one.  Stacks
+    are counted in the collapsed format ``frame;frame;frame count`` that
+    flame graph tools read, outermost frame first.
+    """
+
+    def __init__(self, thread_id, interval=config.PROFILER_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            _original(_thread_module, 'start_new_thread')(self._run, ())
+        return self
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        own_ident = real_get_ident()
+        sleep = _original('time', 'sleep')
+        while self._running:
+            sleep(self.interval)
+            thread_id = self.thread_id() if callable(self.thread_id) else self.thread_id
+            if thread_id is None or thread_id == own_ident:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join('%s %d\n' % item for item in sorted(self.stacks.items()))
+
+    def dump(self, path):
+        with io.open(path, 'w', encoding='utf-8') as fd:
+            fd.write(self.collapsed())
@@ -0,0 +1,131 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pywx import config
+from pywx import patchs  # noqa
+from pywx.exceptions import TransportError, TransportTimeout
+from pywx.utils import endpoint_name
+
+
+class Transport(object):
+    """HTTP transport used by the clients.
+
+    ``request`` must return an object exposing ``content``, ``encoding``,
+    ``json()``, ``iter_content()`` and ``close()`` like
+    :class:`requests.Response`, and ``cookies`` must be a mapping-like jar
+    supporting ``get``.
+    """
+
+    @property
+    def cookies(self):
+        raise NotImplementedError
+
+    def request(self, method, url, **kwargs):
+        raise NotImplementedError
+
+    def dump_cookies(self):
+        raise NotImplementedError
+
+    def load_cookies(self, cookies):
+        raise NotImplementedError
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def _pool_stats(adapter):
+    pools = []
+    manager = adapter.poolmanager
+    for key in manager.pools.keys():
+        pool = manager.pools.get(key)
+        if pool is None:
+            continue
+        # The pool queue holds idle connections and free slots, the rest are in use.
+        in_use = pool.pool.maxsize - pool.pool.qsize() if pool.pool is not None else 0
+        pools.append({
+            'host': pool.host,
+            'port': pool.port,
+            'connections': pool.num_connections,
+            'requests': pool.num_requests,
+            'in_use': in_use,
+            'maxsize': pool.pool.maxsize if pool.pool is not None else 0,
+        })
+    return pools
+
+
+class RequestsTransport(Transport):
+    """Transport over two ``requests`` sessions sharing one cookie jar.
+
+    Long-polls (``LONGPOLL_ENDPOINTS``) go through their own keep-alive pool
+    so they never hold a connection API and media calls are waiting for.
+    Calls without an explicit ``timeout`` get their endpoint's read timeout
+    from ``ENDPOINT_TIMEOUTS``.
+    """
+
+    def __init__(self, session=None, adapter=None, longpoll_adapter=None):
+        self.session = session or requests.Session()
+        self.session.headers.update(config.DEFAULT_HEADERS)
+        self.longpoll_session = requests.Session()
+        self.longpoll_session.headers = self.session.headers
+        self.longpoll_session.cookies = self.session.cookies
+
+        # Adapters hold the connection pools, cookies stay with the sessions.
+        self.adapter = adapter or HTTPAdapter(
+            pool_connections=config.POOL_CONNECTIONS, pool_maxsize=config.POOL_MAXSIZE
+        )
+        self.longpoll_adapter = longpoll_adapter or HTTPAdapter(
+            pool_connections=config.POOL_CONNECTIONS, pool_maxsize=config.LONGPOLL_POOL_MAXSIZE
+        )
+        for prefix in ('https://', 'http://'):
+            self.session.mount(prefix, self.adapter)
+            self.longpoll_session.mount(prefix, self.longpoll_adapter)
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def request(self, method, url, **kwargs):
+        endpoint = endpoint_name(url)
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = (
+                config.CONNECT_TIMEOUT, config.ENDPOINT_TIMEOUTS.get(endpoint, config.DEFAULT_TIMEOUT)
+            )
+        session = self.longpoll_session if endpoint in config.LONGPOLL_ENDPOINTS else self.session
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.Timeout as e:
+            raise TransportTimeout(e)
+        except requests.RequestException as e:
+            raise TransportError(e)
+
+    def dump_cookies(self):
+        return [
+            {
+                'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain,
+                'path': cookie.path, 'secure': cookie.secure, 'expires': cookie.expires,
+            }
+            for cookie in self.session.cookies
+        ]
+
+    def load_cookies(self, cookies):
+        for cookie in cookies:
+            self.session.cookies.set(**cookie)
+
+    def stats(self):
+        return {'api': _pool_stats(self.adapter), 'longpoll': _pool_stats(self.longpoll_adapter)}
+
+    def close(self):
+        self.session.close()
+        self.longpoll_session.close()
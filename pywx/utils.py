@@ -2,10 +2,13 @@
 from __future__ import unicode_literals
 
 import ctypes
+import itertools
 import random
 import re
 import time
 
+from six.moves.urllib.parse import urlparse
+
 
 RE_CHATROOM_USERNAME_PATTERN = re.compile(r'^@@\w+$')
 RE_NORMAL_USERNAME_PATTERN = re.compile(r'^@\w+$')
@@ -13,6 +16,28 @@ RE_NORMAL_USERNAME_PATTERN = re.compile(r'^@\w+$')
 RE_SPAN_PATTERN = re.compile(r'<span class=".*?"></span>')
 RE_EMOJI_PATTERN = re.compile(r'emoji(?P<emoji_code>[0-9a-z]+)')
 
+_client_msg_seq = itertools.count(int(random.random() * 1e4))
+
+
+def endpoint_name(url):
+    """Names an API call by the last segment of its path, ``qrcode/<uuid>`` is ``qrcode``."""
+    path = urlparse(url).path.strip('/')
+    if path.startswith('qrcode'):
+        return 'qrcode'
+    return path.rsplit('/', 1)[-1] or 'unknown'
+
+
+def backoff_delay(attempt, base, maximum=None):
+    """Seconds to wait before retry ``attempt``, counted from 1.
+
+    ``base`` doubles with each retry up to ``maximum`` and is jittered down
+    by up to half, so clients that failed together do not retry together.
+    """
+    delay = base * 2 ** (attempt - 1)
+    if maximum is not None:
+        delay = min(maximum, delay)
+    return delay * random.uniform(0.5, 1.0)
+
 
 def chunks(iterable, chunk_size):
     iterable = list(iterable)
@@ -33,7 +58,8 @@ def gen_device_id():
 
 
 def gen_client_msg_id():
-    return '%d%04d' % (int(time.time() * 1000), int(random.random() * 1e4))
+    # A sequence instead of random digits keeps ids sent within one millisecond distinct.
+    return '%d%04d' % (int(time.time() * 1000), next(_client_msg_seq) % 10000)
 
 
 def is_chatroom(member):
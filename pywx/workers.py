@@ -0,0 +1,137 @@
+# coding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import threading
+from timeit import default_timer
+
+from six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def _spawn_thread(func, *args):
+    thread = threading.Thread(target=func, args=args)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
+
+
+class _WorkerStats(object):
+
+    def __init__(self):
+        self.handled = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+
+class PartitionedWorkerPool(object):
+    """Runs ``handler(item)`` on ``size`` workers.
+
+    Items with the same ``key(item)`` always go to the same worker, so they
+    are handled in submission order while different keys run in parallel.
+    Each worker's queue holds at most ``maxsize`` items, ``submit`` blocks
+    when it is full.  With ``size`` 0 items are handled inline.  Workers
+    start on the first ``submit``; after ``stop`` submitted items are
+    dropped until ``start`` is called again.
+    """
+
+    def __init__(self, handler, size, maxsize, key=None, spawn=_spawn_thread, queue_class=queue.Queue):
+        self.handler = handler
+        self.size = size
+        self.maxsize = maxsize
+        self.key = key or (lambda item: item)
+        self.spawn = spawn
+        self.queue_class = queue_class
+        self.backpressure = 0
+        self.dropped = 0
+        self._stopped = False
+        self._queues = []
+        self._stats = [_WorkerStats() for _ in range(max(size, 1))]
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return bool(self._queues)
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            queues, self._queues = self._queues, []
+        for q in queues:
+            q.put(_STOP)
+
+    def submit(self, item):
+        """Queues ``item``, returns False if it was dropped because the pool is stopped."""
+        with self._lock:
+            if self._stopped:
+                self.dropped += 1
+                return False
+            self._start()
+            queues = self._queues
+        if not self.size:
+            self._handle(item, self._stats[0])
+            return True
+        q = queues[hash(self.key(item)) % self.size]
+        if q.full():
+            self.backpressure += 1
+        q.put(item)
+        return True
+
+    def _start(self):
+        if self._queues or not self.size:
+            return
+        queues = [self.queue_class(self.maxsize) for _ in range(self.size)]
+        for q, stats in zip(queues, self._stats):
+            self.spawn(self._work, q, stats)
+        self._queues = queues
+
+    def join(self):
+        for q in list(self._queues):
+            q.join()
+
+    def stats(self):
+        handled = sum(stats.handled for stats in self._stats)
+        latency_total = sum(stats.latency_total for stats in self._stats)
+        return {
+            'workers': self.size,
+            'queued': sum(q.qsize() for q in self._queues),
+            'handled': handled,
+            'failed': sum(stats.failed for stats in self._stats),
+            'backpressure': self.backpressure,
+            'dropped': self.dropped,
+            'latency_avg_ms': latency_total / handled * 1000 if handled else 0.0,
+            'latency_max_ms': max(stats.latency_max for stats in self._stats) * 1000,
+        }
+
+    def _work(self, q, stats):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                self._handle(item, stats)
+            finally:
+                q.task_done()
+
+    def _handle(self, item, stats):
+        started = default_timer()
+        try:
+            self.handler(item)
+        except Exception:
+            stats.failed += 1
+            logger.exception('handler failed')
+        latency = default_timer() - started
+        stats.handled += 1
+        stats.latency_total += latency
+        if latency > stats.latency_max:
+            stats.latency_max = latency
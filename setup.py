@@ -38,5 +38,8 @@ setup(
         'lxml',
         'six',
         'enum34'
-    ]
+    ],
+    extras_require={
+        'terminal': ['qrcode'],
+    }
 )